@@ -0,0 +1,253 @@
+import io
+import csv
+import json
+from bisect import bisect_left, bisect_right
+from datetime import datetime
+from urllib.parse import urlencode
+import flask
+import store
+
+# A read-only JSON/CSV API over the areas the dashboard serves
+# (refresh.Areas), mounted by app.py under /api/v1:
+#
+#   /locations?level=&state=&offset=&limit=
+#   /series?ids=&metrics=&start=&end=            one row per id, by date
+#   /section?level=&date=&state=&metrics=&offset=&limit=   one row per location
+#   /export?level=&state=&metrics=&start=&end=&format=    streamed long rows
+#
+# A location is a country's iso3, a state's abbreviation or a county's FIPS.
+# Metrics are the columns of store.values (a series or its '_rate'); dates
+# are YYYY-MM-DD and `end` is inclusive. Everything is read from the
+# Timeline matrices of an area, so a county export goes state by state and
+# only one state's rows are held at a time, and a page of counties only loads
+# the states it covers.
+LIMIT = 100
+MAX_LIMIT = 1000
+MAX_IDS = 100
+# level: (area, key, attributes)
+LEVELS = {
+    'country':('World', 'iso3', ['Country/Region', 'Population']),
+    'state':('USA', 'abbreviation', ['Province_State', 'number', 'Population']),
+    'county':(None, 'FIPS', ['Admin2', 'Province_State', 'number', 'Population']),
+}
+
+class Invalid(Exception):
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.status=status
+
+def argument(name, default=None, choices=None):
+    value=flask.request.args.get(name, default)
+    if choices is not None and value not in choices:
+        raise Invalid(f'{name} must be one of {", ".join(choices)}')
+    return value
+
+def integer(name, default, low, high):
+    try:
+        value=int(flask.request.args.get(name, default))
+    except ValueError:
+        raise Invalid(f'{name} must be an integer')
+    if not low<=value<=high:
+        raise Invalid(f'{name} must be between {low} and {high}')
+    return value
+
+def day(name):
+    value=argument(name)
+    if value is None:
+        return None
+    try:
+        return datetime.strptime(value, '%Y-%m-%d').strftime('%Y-%m-%d')
+    except ValueError:
+        raise Invalid(f'{name} must be a date as YYYY-MM-DD')
+
+def metrics(timeline):
+    names=[name for name in argument('metrics', '').split(',') if name] or [metric for metric in store.METRICS if metric in timeline.values]
+    unknown=[name for name in names if name not in timeline.values]
+    if unknown:
+        raise Invalid(f'unknown metrics {", ".join(unknown)}; available: {", ".join(timeline.values)}')
+    return names
+
+# The slice of timeline.dates from `start` through `end`.
+def date_range(dates, start, end):
+    return slice(bisect_left(dates, start) if start else 0, bisect_right(dates, end) if end else len(dates))
+
+# {label: {attribute: value}} of an area's locations.
+def attributes(area, key, columns):
+    dimension=area.dimension
+    columns=[col for col in columns if col in dimension]
+    values={col:dimension[col].tolist() for col in [key]+columns}
+    return {label:{col:values[col][i] for col in columns} for i, label in enumerate(values[key])}
+
+class API:
+    def __init__(self, frames):
+        self.frames=frames
+
+    def states(self, areas):
+        usa=areas.get('USA')
+        numbers=sorted(set(usa.dimension['number'].astype(str))) if usa is not None and 'number' in usa.dimension else []
+        state=argument('state')
+        if state is None:
+            return numbers
+        number=attributes(usa, 'abbreviation', ['number']).get(state.upper(), {}).get('number', state)
+        if number not in numbers:
+            raise Invalid(f'unknown state {state}', 404)
+        return [number]
+
+    # (area name, Area) for every area a level covers, read one at a time and
+    # without going through the Areas LRU.
+    def areas(self, level):
+        areas=self.frames().areas
+        name=LEVELS[level][0]
+        if name is not None:
+            yield name, areas.read(name)
+            return
+        for number in self.states(areas):
+            area=areas.read(number)
+            if area is not None:
+                yield number, area
+
+    # (Area, start, stop) for the areas of a level holding the locations
+    # offset to offset+limit, in order, and the level's number of locations.
+    # A state is only loaded when the page covers some of its counties.
+    def window(self, level, offset, limit):
+        areas=self.frames().areas
+        name=LEVELS[level][0]
+        if name is not None:
+            sizes=[(name, len(areas.get(name).timeline.labels))]
+        else:
+            sizes=[(number, areas.count(number)) for number in self.states(areas)]
+        parts, total=[], 0
+        for number, size in sizes:
+            start, stop=max(0, offset-total), min(size, offset+limit-total)
+            area=areas.get(number) if start<stop else None
+            if area is not None:
+                parts.append((area, start, stop))
+            total+=size
+        return parts, total
+
+    def find(self, areas, location):
+        if len(location)==5 and location.isdigit():
+            level, area=LEVELS['county'], areas.get(location[:2])
+        elif len(location)==2:
+            level, area=LEVELS['state'], areas.get('USA')
+        else:
+            level, area=LEVELS['country'], areas.get('World')
+        timeline=area and area.timeline
+        if timeline is None or location not in timeline.labels:
+            raise Invalid(f'unknown location {location}', 404)
+        return area, timeline.labels.index(location), level
+
+    def locations(self):
+        level=argument('level', 'country', LEVELS)
+        offset, limit=integer('offset', 0, 0, 10**9), integer('limit', LIMIT, 1, MAX_LIMIT)
+        key, columns=LEVELS[level][1:]
+        parts, total=self.window(level, offset, limit)
+        result=[]
+        for area, start, stop in parts:
+            values=attributes(area, key, columns)
+            result+=[{'id':label, **values[label]} for label in area.timeline.labels[start:stop]]
+        return page(result, total, offset, limit)
+
+    def series(self):
+        ids=[location.strip() for location in argument('ids', '').split(',') if location.strip()]
+        if not ids or len(ids)>MAX_IDS:
+            raise Invalid(f'ids takes 1 to {MAX_IDS} locations')
+        areas=self.frames().areas
+        start, end=day('start'), day('end')
+        result={'series':dict()}
+        for location in ids:
+            area, row, _=self.find(areas, location.upper() if len(location)<5 else location)
+            timeline=area.timeline
+            dates=date_range(timeline.dates, start, end)
+            result['series'][location]={'dates':timeline.dates[dates],
+                                        **{name:store.rows(timeline.values[name][row:row+1, dates])[0] for name in metrics(timeline)}}
+        return result
+
+    def section(self):
+        level=argument('level', 'country', LEVELS)
+        offset, limit=integer('offset', 0, 0, 10**9), integer('limit', LIMIT, 1, MAX_LIMIT)
+        # the dates and metrics of the level's own area, USA for the counties
+        reference=self.frames().areas.get(LEVELS[level][0] or 'USA').timeline
+        names=metrics(reference)
+        if len(reference.dates)==0:
+            return page([], 0, offset, limit)
+        date=day('date') or reference.dates[-1]
+        if date not in reference.dates:
+            raise Invalid(f'no data for {date}', 404)
+        parts, total=self.window(level, offset, limit)
+        result=[]
+        for area, start, stop in parts:
+            timeline=area.timeline
+            labels=timeline.labels[start:stop]
+            column=timeline.dates.index(date) if date in timeline.dates else None
+            values={name:store.rows(timeline.values[name][start:stop, column][None])[0]
+                    if column is not None and name in timeline.values else [None]*len(labels) for name in names}
+            result+=[{'id':label, 'date':date, **{name:values[name][i] for name in names}} for i, label in enumerate(labels)]
+        return page(result, total, offset, limit)
+
+    # Chunks of long rows (id, date, metrics...), one chunk per area, after
+    # a header line for CSV.
+    def export(self, level, format):
+        start, end=day('start'), day('end')
+        names=None
+        for _, area in self.areas(level):
+            timeline=area.timeline
+            if names is None:
+                names=metrics(timeline)
+                if format=='csv':
+                    yield ','.join(['id', 'date']+names)+'\n'
+            dates=date_range(timeline.dates, start, end)
+            columns=[store.rows(timeline.values[name][:, dates]) for name in names]
+            days=timeline.dates[dates]
+            rows=([label, day]+[values[i][j] for values in columns]
+                  for i, label in enumerate(timeline.labels) for j, day in enumerate(days))
+            out=io.StringIO()
+            if format=='csv':
+                csv.writer(out, lineterminator='\n').writerows(rows)
+            else:
+                out.writelines(json.dumps(dict(zip(['id', 'date']+names, row)))+'\n' for row in rows)
+            yield out.getvalue()
+
+def page(items, total, offset, limit):
+    result={'items':items, 'total':total, 'offset':offset, 'limit':limit}
+    if offset+limit<total:
+        result['next']=flask.request.base_url+'?'+urlencode({**flask.request.args.to_dict(), 'offset':offset+limit}, safe=',')
+    return result
+
+# The blueprint, with `frames` returning the refresh.Frames to answer from.
+def blueprint(frames):
+    api=API(frames)
+    routes=flask.Blueprint('api', __name__, url_prefix='/api/v1')
+
+    @routes.errorhandler(Invalid)
+    def invalid(error):
+        return flask.jsonify({'error':str(error)}), error.status
+
+    @routes.route('/locations')
+    def locations():
+        return flask.jsonify(dict(api.locations(), version=frames().version))
+
+    @routes.route('/series')
+    def series():
+        return flask.jsonify(dict(api.series(), version=frames().version))
+
+    @routes.route('/section')
+    def section():
+        return flask.jsonify(dict(api.section(), version=frames().version))
+
+    @routes.route('/export')
+    def export():
+        level=argument('level', 'county', LEVELS)
+        format=argument('format', 'csv', ['csv', 'jsonl'])
+        chunks=api.export(level, format)
+        # the first chunk is read here, so a bad argument is still a 400
+        first=next(chunks, '')
+        def body():
+            yield first
+            yield from chunks
+        mimetype='text/csv' if format=='csv' else 'application/x-ndjson'
+        response=flask.Response(flask.stream_with_context(body()), mimetype=mimetype)
+        response.headers['X-Data-Version']=frames().version or ''
+        return response
+
+    return routes
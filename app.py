@@ -11,125 +11,18 @@ import dash_html_components as html
 import flask
 from flask_caching import Cache
 import json
-from urllib.request import urlopen
 
-INPUT_URL = "https://raw.githubusercontent.com/CSSEGISandData/COVID-19/master/csse_covid_19_data/"
-df_lookup = pd.read_csv(INPUT_URL+"UID_ISO_FIPS_LookUp_Table.csv");
+from refresh import Refresher
+import store
+import memo
+import metrics
+import responses
+import api
+import warmup
+import geo
+import schema
 
-def transform_and_standardize(df, var_name):
-    df = df.drop(columns=['Lat', 'Long']).merge(
-        df_lookup.rename(columns={'Country_Region': 'Country/Region', 'Province_State': 'Province/State'})[['Country/Region', 'Province/State', 'iso3','Population']],
-        how='outer',
-        on=['Country/Region', 'Province/State']
-    ).dropna(subset=["iso3"])
-    df = df.groupby(['iso3','Country/Region']).sum().reset_index()
-    df = df.melt(id_vars=[df.columns[0],df.columns[1],df.columns[-1]], 
-        value_vars=df.columns[2:-1], 
-        var_name='date', 
-        value_name=var_name
-    ).dropna()
-    df['date']=pd.to_datetime(df['date'])
-    return df.sort_values(by=['iso3', 'date'])
-
-def transform_and_standardize_us(df, var_name):
-    if var_name == 'deaths':
-        df=df.drop(columns=['Population'])
-    df = df.drop(columns=['UID','iso2','iso3','Country_Region','code3']).groupby(['FIPS','Admin2','Province_State','Lat','Long_']).sum().reset_index()
-    df = df.melt(id_vars=[df.columns[0],df.columns[1],df.columns[2],df.columns[3],df.columns[4]], 
-        value_vars=df.columns[5:], 
-        var_name='date', 
-        value_name=var_name
-    ).dropna()
-    df['date']=pd.to_datetime(df['date'])
-    return df.sort_values(by=['FIPS', 'date'])
-
-df_confirmed = transform_and_standardize(pd.read_csv(INPUT_URL+"csse_covid_19_time_series/time_series_covid19_confirmed_global.csv"), 'confirmed')
-df_deaths = transform_and_standardize(pd.read_csv(INPUT_URL+"csse_covid_19_time_series/time_series_covid19_deaths_global.csv"), 'deaths')
-df_recovered = transform_and_standardize(pd.read_csv(INPUT_URL+"csse_covid_19_time_series/time_series_covid19_recovered_global.csv"), 'recovered')
-df = df_confirmed.merge(df_deaths,how='outer',on=['date', 'iso3', 'Population','Country/Region']).merge(df_recovered,how='outer',on=['date', 'iso3', 'Population','Country/Region'])
-for col in ['confirmed', 'deaths', 'recovered']:
-    df[f'{col}_rate'] = (df[col]/df['Population']*1000000000).astype('int64')
-
-df_confirmed_us = transform_and_standardize_us(pd.read_csv(INPUT_URL+"csse_covid_19_time_series/time_series_covid19_confirmed_US.csv"), 'confirmed')
-df_deaths_us = transform_and_standardize_us(pd.read_csv(INPUT_URL+"csse_covid_19_time_series/time_series_covid19_deaths_US.csv"), 'deaths').drop(columns=['Lat','Long_'])
-df_us=df_confirmed_us.merge(df_deaths_us,how='outer',on=['date', 'FIPS', 'Admin2','Province_State'])
-df_us=df_us.merge(df_lookup[['FIPS','Population']],
-                  how='outer',
-                  on=['FIPS']).dropna()
-df_us = df_us.astype({'FIPS':'int','confirmed':'int','deaths':'int','Population':'int'})
-df_states=df_us.drop(columns=['FIPS']).groupby(['Province_State','date',]).sum().reset_index()
-for col in ['confirmed', 'deaths']:
-    df_states[f'{col}_rate'] = (df_states[col]/df_states['Population']*1000000000).astype('int64')
-    df_us[f'{col}_rate'] = (df_us[col]/df_us['Population']*1000000000).astype('int64')
-abbreviations={
-    "Alabama": ["01", "AL"],
-    "Alaska": ["02", "AK"],
-    "Arizona": ["04", "AZ"],
-    "Arkansas": ["05", "AR"],
-    "California": ["06", "CA"],
-    "Colorado": ["08", "CO"],
-    "Connecticut": ["09", "CT"],
-    "Delaware": ["10", "DE"],
-    "District of Columbia": ["11", "DC"],
-    "Florida": ["12", "FL"],
-    "Georgia": ["13", "GA"],
-    "Hawaii": ["15", "HI"],
-    "Idaho": ["16", "ID"],
-    "Illinois": ["17", "IL"],
-    "Indiana": ["18", "IN"],
-    "Iowa": ["19", "IA"],
-    "Kansas": ["20", "KS"],
-    "Kentucky": ["21", "KY"],
-    "Louisiana": ["22", "LA"],
-    "Maine": ["23", "ME"],
-    "Maryland": ["24", "MD"],
-    "Massachusetts": ["25", "MA"],
-    "Michigan": ["26", "MI"],
-    "Minnesota": ["27", "MN"],
-    "Mississippi": ["28", "MS"],
-    "Missouri": ["29", "MO"],
-    "Montana": ["30", "MT"],
-    "Nebraska": ["31", "NE"],
-    "Nevada": ["32", "NV"],
-    "New Hampshire": ["33", "NH"],
-    "New Jersey": ["34", "NJ"],
-    "New Mexico": ["35", "NM"],
-    "New York": ["36", "NY"],
-    "North Carolina": ["37", "NC"],
-    "North Dakota": ["38", "ND"],
-    "Ohio": ["39", "OH"],
-    "Oklahoma": ["40", "OK"],
-    "Oregon": ["41", "OR"],
-    "Pennsylvania": ["42", "PA"],
-    "Rhode Island": ["44", "RI"],
-    "South Carolina": ["45", "SC"],
-    "South Dakota": ["46", "SD"],
-    "Tennessee": ["47", "TN"],
-    "Texas": ["48", "TX"],
-    "Utah": ["49", "UT"],
-    "Vermont": ["50", "VT"],
-    "Virginia": ["51", "VA"],
-    "Washington": ["53", "WA"],
-    "West Virginia": ["54", "WV"],
-    "Wisconsin": ["55", "WI"],
-    "Wyoming": ["56", "WY"],
-    "American Samoa": ["60", "AS"],
-    "Guam": ["66", "GU"],
-    "Northern Mariana Islands": ["69", "MP"],
-    "Puerto Rico": ["72", "PR"],
-    "Virgin Islands": ["78", "VI"]
-}
-df_states['number']=df_states['Province_State'].map(lambda x: abbreviations[x][0])
-df_states['abbreviation']=df_states['Province_State'].map(lambda x: abbreviations[x][1])
-df_us['number']=df_us['Province_State'].map(lambda x: abbreviations[x][0])
-df_us['FIPS']=df_us['FIPS'].astype(str).str.zfill(5)
-with urlopen('https://raw.githubusercontent.com/plotly/datasets/master/geojson-counties-fips.json') as response:
-    counties = json.load(response)
-df_geo=dict()
-for county in counties['features']:
-    area=county['properties']['STATE']
-    df_geo.setdefault(area,{'type':'FeatureCollection', 'features':[]})
-    df_geo[area]['features'].append(county)
+refresher = Refresher()
 
 colorscale=[[0.0,      'rgb(255,255,255)'],
             [0.000001, 'rgb(255,245,240)'],
@@ -144,117 +37,233 @@ colorscale=[[0.0,      'rgb(255,255,255)'],
             [0.1,      'rgb(60,0,7)'],
             [1.0,      'rgb(30,0,0)']]
 
+# Color range and marker scale of the map by kind of series: cumulative
+# counts per population, daily counts per population, and doubling time in
+# days, short being the worst.
+SCALES = {
+    'rate':{'zmax':1000000000, 'colorscale':colorscale, 'size':1},
+    'new':{'zmax':10000000, 'colorscale':colorscale, 'size':50},
+    'avg7':{'zmax':10000000, 'colorscale':colorscale, 'size':50},
+    'doubling':{'zmax':60, 'colorscale':[[0.0, 'rgb(103,0,13)'], [1.0, 'rgb(255,245,240)']], 'size':100},
+}
+LABELS = {'':'', 'new':'daily', 'avg7':'7-day average', 'doubling':'doubling days'}
+
 unixTimeMillis = lambda dt: int(time.mktime(dt.timetuple()))
 external_stylesheets = ['https://codepen.io/chriddyp/pen/bWLwgP.css', 'https://codepen.io/chriddyp/pen/brPBPO.css']
 server = flask.Flask(__name__)
 app = dash.Dash(__name__, external_stylesheets=external_stylesheets,server=server)
-CACHE_CONFIG = {
-    'CACHE_TYPE': 'simple',
-    'CACHE_REDIS_URL': os.environ.get('REDIS_URL', 'redis://localhost:6379')
-}
+# With WARMUP the simple and filesystem backends keep the warmed results on
+# top of their usual entries.
+CACHE_CONFIG = memo.cache_config(threshold=memo.CACHE_THRESHOLD+(warmup.WARMUP_ENTRIES if warmup.WARMUP else 0))
 
 cache = Cache()
 cache.init_app(app.server, config=CACHE_CONFIG)
-TIMEOUT=86400
-app.layout = html.Div([
-    dcc.Store(id="date"),
-    dcc.Store(id="geojson"),
-    dcc.Store(id="location"),
-    html.Div([
-        dcc.Graph(id='graph-with-slider', hoverData={'points': [{'customdata': 'USA'}]}),
-    ], style={"height": "calc(50vh - 40px)"}),
-    html.Div([
-        dcc.Graph(id='time-series')
-    ], style={"height": "calc(50vh - 40px)"}),
-    html.Div([
-        dcc.Dropdown(
-            id='select-area',
-            options=[
-                {'label':'World','value':'World'},
-                {'label':'USA','value':'USA'}
-            ]+[{'label':x,'value':x} for x in df_states['number'].unique()],
-            value='World',
-        )
-    ], style={'width': '175px', 'display': 'inline-block'}),
-    html.Div([
-        dcc.Dropdown(
-            id='select-graph',
-            options=[
-                {'label': 'Scatter',    'value': 'scatter'},
-                {'label': 'Choropleth', 'value': 'choropleth'}
-            ],
-            value=['choropleth'],
-            multi=True
-        )
-    ], style={'width': '250px', 'display': 'inline-block'}),
-    html.Div([
-        dcc.Dropdown(
-            id='select-data',
-            options=[
-                {'label': 'confirmed',    'value': 'confirmed'},
-                {'label': 'deaths', 'value': 'deaths'},
-                {'label': 'recovered', 'value': 'recovered'}
-            ],
-            value='confirmed'
-        )
-    ], style={'width': '125px', 'display': 'inline-block'}),
-    html.Div([
-        dcc.Slider(
-            id='date-slider',
-            min=unixTimeMillis(df['date'].min()),
-            max=unixTimeMillis(df['date'].max()),
-            value=unixTimeMillis(df['date'].min()),
-            marks={unixTimeMillis(date):{'label':str(date.strftime('%m/%d')).lstrip('0').replace('/0','/'),'style':{'writing-mode': 'vertical-lr','text-orientation': 'sideways'}} for date in df['date']},
-            step=None
-        )
-    ], style={'width': 'calc(100% - 550px)', 'display': 'inline-block'})
+memoize = memo.memoize(cache, lambda: refresher.frames.version)
+server.teardown_request(metrics.teardown_request)
+# 'binary' sends df_date as typed arrays plus per-area location attributes
+WIRE_FORMAT=os.environ.get('WIRE_FORMAT', 'json')
+# '1' sends every date of the selected area and metric at once and slices the
+# slider's frames out of it in the browser
+PREFETCH=os.environ.get('PREFETCH', '0')=='1'
 
-])
+# A function so that every new session gets the slider range of the data
+# loaded at that moment.
+def serve_layout():
+    df, states = refresher.frames.df, refresher.frames.areas.get('USA').dimension
+    return html.Div([
+        dcc.Store(id="date"),
+        dcc.Store(id="geojson"),
+        dcc.Store(id="location"),
+        dcc.Store(id="locations"),
+        dcc.Store(id="range"),
+        dcc.Store(id="zoom", data=1),
+        dcc.Interval(id='play-interval', interval=250, disabled=True),
+        html.Div([
+            dcc.Graph(id='graph-with-slider', hoverData={'points': [{'customdata': 'USA'}]}),
+        ], style={"height": "calc(50vh - 40px)"}),
+        html.Div([
+            dcc.Graph(id='time-series')
+        ], style={"height": "calc(50vh - 40px)"}),
+        html.Div([
+            dcc.Dropdown(
+                id='select-area',
+                options=[
+                    {'label':'World','value':'World'},
+                    {'label':'USA','value':'USA'}
+                ]+[{'label':x,'value':x} for x in states['number'].unique()],
+                value='World',
+            )
+        ], style={'width': '175px', 'display': 'inline-block'}),
+        html.Div([
+            dcc.Dropdown(
+                id='select-graph',
+                options=[
+                    {'label': 'Scatter',    'value': 'scatter'},
+                    {'label': 'Choropleth', 'value': 'choropleth'}
+                ],
+                value=['choropleth'],
+                multi=True
+            )
+        ], style={'width': '250px', 'display': 'inline-block'}),
+        html.Div([
+            dcc.Dropdown(
+                id='select-data',
+                options=[{'label':f'{metric} {LABELS[name[len(metric)+1:]]}'.strip(), 'value':name}
+                         for metric in store.METRICS for name in store.series(metric)],
+                value='confirmed'
+            )
+        ], style={'width': '200px', 'display': 'inline-block'}),
+        html.Div([
+            html.Button('Play', id='play', style={'width': '70px', 'padding': '0'})
+        ], style={'width': '70px', 'display': 'inline-block', 'vertical-align': 'top'}),
+        html.Div([
+            dcc.Slider(
+                id='date-slider',
+                min=unixTimeMillis(df['date'].min()),
+                max=unixTimeMillis(df['date'].max()),
+                value=unixTimeMillis(df['date'].min()),
+                marks={unixTimeMillis(date):{'label':str(date.strftime('%m/%d')).lstrip('0').replace('/0','/'),'style':{'writing-mode': 'vertical-lr','text-orientation': 'sideways'}} for date in df['date'].drop_duplicates()},
+                step=None
+            )
+        ], style={'width': 'calc(100% - 695px)', 'display': 'inline-block'})
 
-@app.callback(Output('date', 'data'),
-             [Input('date-slider', 'value'),
-              Input('select-area', 'value')])
-@cache.memoize()
-def df_date(date, area):
+    ])
+
+app.layout = serve_layout
+
+# The rows of a date with the cumulative metrics, plus the columns of `data`
+# when a derived series is selected.
+@metrics.instrument
+@memoize
+def df_date(date, area, data='confirmed'):
+    frames=refresher.frames
     date_parsed=datetime.fromtimestamp(date)
-    if area=="World":
-        temp=df
-    elif area=="USA":
-        temp=df_states
-    else:
-        temp=df_us.query('number==@area')
-    return temp.query('date==@date_parsed').to_dict('list')
+    selected=frames.areas.get(area)
+    if selected is None:
+        return None
+    temp=selected.facts
+    start, stop=selected.dates.get(pd.Timestamp(date_parsed).value, (0, 0))
+    names=[col for metric in store.METRICS+[data or store.METRICS[0]] for col in store.columns(metric) if col in temp]
+    if WIRE_FORMAT=='binary':
+        return dict(store.binary_rows(temp, start, stop, selected.locations, names), area=area)
+    return schema.rows(temp, selected.dimension, start, stop, [col for col in store.values(temp) if col not in names])
 
-@app.callback(Output('geojson', 'data'),
+@metrics.instrument
+@memoize
+def df_range(data, area):
+    frames=refresher.frames
+    selected=frames.areas.get(area)
+    if selected is None or data not in selected.timeline.values:
+        return dict()
+    timeline, location=selected.timeline, selected.locations
+    ticks=[unixTimeMillis(datetime.strptime(date, '%Y-%m-%d')) for date in timeline.dates]
+    return dict(store.dense(timeline, data), area=area, metric=data, version=frames.version,
+                ticks=ticks, attributes=location.attributes)
+
+if PREFETCH:
+    app.callback(Output('range', 'data'),
+                [Input('select-data', 'value'),
+                 Input('select-area', 'value')])(df_range)
+    app.clientside_callback(
+        """
+        function(date, area, range) {
+            if (!range || range['area']!==area)
+                return window.dash_clientside.no_update
+            return window.coronavirus.frame(range, range['ticks'].indexOf(date))
+        }
+        """,
+        Output('date', 'data'),
+       [Input('date-slider', 'value'),
+        Input('select-area', 'value'),
+        Input('range', 'data')]
+    )
+else:
+    app.callback(Output('date', 'data'),
+                [Input('date-slider', 'value'),
+                 Input('select-area', 'value'),
+                 Input('select-data', 'value')])(df_date)
+
+@app.callback(Output('locations', 'data'),
              [Input('select-area', 'value')])
-@cache.memoize()
-def df_geojson(area):
+@metrics.instrument
+@memoize
+def df_locations(area):
+    if WIRE_FORMAT!='binary':
+        return dict()
+    selected=refresher.frames.areas.get(area)
+    if selected is None:
+        return dict()
+    return {'area':area, 'attributes':selected.locations.attributes}
+
+# A state's shapes at a geo.LEVELS level (or 'full') as an encoded response
+# body, built once per data version.
+def geometry(area, level):
+    frames=refresher.frames
+    return responses.bodies.get((frames.version, 'geometry', area, level),
+                                lambda: responses.dumps(frames.areas.geojson(area, level)))
+
+# The URL of the county shapes at the detail the view needs: the level is
+# picked from the state's extent and the map's zoom. The URL names the
+# content, so the browser keeps the shapes for as long as they do not change.
+@app.callback(Output('geojson', 'data'),
+             [Input('select-area', 'value'),
+              Input('zoom', 'data')])
+@metrics.instrument
+@memoize
+def df_geojson(area, zoom=1):
+    frames=refresher.frames
     if area=="World" or area=="USA":
         return dict()
-    else:
-        return df_geo[area]
+    if area not in frames.spans:
+        return dict()
+    level=geo.choose(frames.spans[area], zoom or 1)
+    return {'area':area, 'url':app.get_relative_path(f'/geometry/{area}/{level}.{geometry(area, level).digest}.json')}
+
+@server.route('/geometry/<area>/<level>.<digest>.json')
+def geometry_file(area, level, digest):
+    if area not in refresher.frames.spans or level not in ['full']+[name for name, _, _ in geo.LEVELS]:
+        flask.abort(404)
+    body=geometry(area, level)
+    if body.digest!=digest:
+        flask.abort(404)
+    return body.response(cache_control=responses.IMMUTABLE)
+
+# The map's zoom, rounded down to a power of two, so df_geojson is only asked
+# again when the detail level might change.
+app.clientside_callback(
+    """
+    function(relayoutData, zoom) {
+        var scale=relayoutData && relayoutData['geo.projection.scale']
+        if (!scale)
+            return window.dash_clientside.no_update
+        var bucket=Math.pow(2, Math.max(0, Math.min(4, Math.floor(Math.log2(scale)))))
+        return bucket===zoom ? window.dash_clientside.no_update : bucket
+    }
+    """,
+    Output('zoom', 'data'),
+    [Input('graph-with-slider', 'relayoutData')],
+    [State('zoom', 'data')]
+)
 
 @app.callback(Output('location', 'data'),
              [Input('select-data', 'value'),
               Input('select-area', 'value')])
-@cache.memoize()
+@metrics.instrument
+@memoize
 def df_location(data, area):
-    if not area or area=="World":
-        temp=df.groupby('iso3')
-    elif area=="USA":
-        temp=df_states.groupby('abbreviation')
-    else:
-        temp=df_us.groupby('FIPS')
-    return temp[['date',data]].apply(lambda x: x.values.T.tolist()).to_dict()
+    selected=refresher.frames.areas.get(area or 'World')
+    if selected is None or data not in selected.timeline.values:
+        return {'dates':[], 'series':{}}
+    return store.payload(selected.timeline, data)
 
 app.clientside_callback(
     """
     function(df_by_loc, hoverData) {
-        var loc_name=hoverData['points'][0]['location'] || 'USA'
+        var loc_name=hoverData['points'][0]['location']
         return {
             'data': [{
-                'x':df_by_loc[loc_name][0],
-                'y':df_by_loc[loc_name][1]
+                'x':df_by_loc['dates'],
+                'y':(loc_name && df_by_loc['series'][loc_name]) || df_by_loc['total']
             }]
         }
     }
@@ -264,105 +273,122 @@ app.clientside_callback(
     Input('graph-with-slider', 'hoverData')]
 )
 
-@app.callback(Output('graph-with-slider', 'figure'),
-             [Input('date', 'data'),
-              Input('geojson', 'data'),
-              Input('date-slider', 'value'),
-              Input('select-graph', 'value'),
-              Input('select-data', 'value')])
-def update_map(df_by_date, geojson_by_state, date, graph, data):
-    traces=[]
-    if 'FIPS' in df_by_date:
-        scope='usa'
-        if 'scatter' in graph:
-            traces.append({
-                'type':'scattergeo',
-                'lat':df_by_date['Lat'],
-                'lon':df_by_date['Long_'],
-                'text':df_by_date['Admin2'],
-                'customdata':["USA"]*len(df_by_date[data]),
-                'marker':{'size':[x/5000 for x in df_by_date[data]],'sizemode':'area','color':'red'}
-            })
-        if 'choropleth' in graph:
-            traces.append({
-                'type':'choropleth',
-                'geojson':geojson_by_state,
-                'locations':df_by_date['FIPS'],
-                'z':df_by_date[f'{data}_rate'],
-                'zmin':0,
-                'zmax':1000000000,
-                'text':df_by_date['Admin2'],
-                'customdata':["USA"]*len(df_by_date[data]),
-                'autocolorscale':False,
-                'colorscale':colorscale,
-                'showscale':False
-            })
-    elif 'Province_State' in df_by_date:
-        scope='usa'
-        if 'scatter' in graph:
-            traces.append({
-                'type':'scattergeo',
-                'locations':df_by_date['abbreviation'],
-                'locationmode':'USA-states',
-                'text':df_by_date['Province_State'],
-                'customdata':df_by_date['number'],
-                'marker':{'size':[x/1000 for x in df_by_date[data]],'sizemode':'area','color':'red'}
-            })
-        if 'choropleth' in graph:
-            traces.append({
-                'type':'choropleth',
-                'locations':df_by_date['abbreviation'],
-                'locationmode':'USA-states',
-                'z':df_by_date[f'{data}_rate'],
-                'zmin':0,
-                'zmax':1000000000,
-                'text':df_by_date['Province_State'],
-                'customdata':df_by_date['number'],
-                'autocolorscale':False,
-                'colorscale':colorscale,
-                'showscale':False
-            })
-    else:
-        scope='world'
-        if 'scatter' in graph:
-            traces.append({
-                'type':'scattergeo',
-                'locations':df_by_date['iso3'],
-                'locationmode':'ISO-3',
-                'text':df_by_date['Country/Region'],
-                'customdata':["USA" if x=="USA" else "World" for x in df_by_date['iso3']],
-                'marker':{'size':[x/2000 for x in df_by_date[data]],'sizemode':'area','color':'red'}
-            })
-        if 'choropleth' in graph:
-            traces.append({
-                'type':'choropleth',
-                'locations':df_by_date['iso3'],
-                'locationmode':'ISO-3',
-                'z':df_by_date[f'{data}_rate'],
-                'zmin':0,
-                'zmax':1000000000,
-                'text':df_by_date['Country/Region'],
-                'customdata':["USA" if x=="USA" else "World" for x in df_by_date['iso3']],
-                'autocolorscale':False,
-                'colorscale':colorscale,
-                'showscale':False
-            })
-    return {
-        'data': traces,
-        'layout': {
-            'margin':{'l':0,'r':0,'t':0,'b':0,'pad':0},
-            'uirevision':True,
-            'geo':{'margin':{'l':0,'r':0,'t':0,'b':0,'pad':0},
-                   'uirevision':True,
-                   'showland':True,
-                   'landcolor':'#dddddd',
-                   'showcountries':True,
-                   'fitbounds':'geojson',
-                   'showframe': False,
-                   'showcoastlines': True},
-            'hovermode':'closest'
+# The map figure is assembled in the browser from the date, locations and
+# geojson stores, so scrubbing the slider only costs the server df_date.
+app.clientside_callback(
+    """
+    function(df_by_date, locations, geojson_by_state, date, graph, data) {
+        if (!df_by_date)
+            return window.dash_clientside.no_update
+        if (df_by_date['loc']) {
+            if (!locations || locations['area']!==df_by_date['area'])
+                return window.dash_clientside.no_update
+            df_by_date=window.coronavirus.expand(df_by_date, locations['attributes'])
+        }
+        var scale=SCALES[data.slice(data.lastIndexOf('_')+1)] || SCALES['rate']
+        var colorscale=scale['colorscale']
+        var z=df_by_date[data+'_rate'] || df_by_date[data]
+        var traces=[]
+        if ('FIPS' in df_by_date) {
+            if (graph.includes('scatter'))
+                traces.push({
+                    'type':'scattergeo',
+                    'lat':df_by_date['Lat'],
+                    'lon':df_by_date['Long_'],
+                    'text':df_by_date['Admin2'],
+                    'customdata':df_by_date[data].map(x => 'USA'),
+                    'marker':{'size':df_by_date[data].map(x => x*scale['size']/5000),'sizemode':'area','color':'red'}
+                })
+            if (graph.includes('choropleth'))
+                traces.push({
+                    'type':'choropleth',
+                    'geojson':geojson_by_state && geojson_by_state['url'],
+                    'locations':df_by_date['FIPS'],
+                    'z':z,
+                    'zmin':0,
+                    'zmax':scale['zmax'],
+                    'text':df_by_date['Admin2'],
+                    'customdata':df_by_date[data].map(x => 'USA'),
+                    'autocolorscale':false,
+                    'colorscale':colorscale,
+                    'showscale':false
+                })
+        } else if ('Province_State' in df_by_date) {
+            if (graph.includes('scatter'))
+                traces.push({
+                    'type':'scattergeo',
+                    'locations':df_by_date['abbreviation'],
+                    'locationmode':'USA-states',
+                    'text':df_by_date['Province_State'],
+                    'customdata':df_by_date['number'],
+                    'marker':{'size':df_by_date[data].map(x => x*scale['size']/1000),'sizemode':'area','color':'red'}
+                })
+            if (graph.includes('choropleth'))
+                traces.push({
+                    'type':'choropleth',
+                    'locations':df_by_date['abbreviation'],
+                    'locationmode':'USA-states',
+                    'z':z,
+                    'zmin':0,
+                    'zmax':scale['zmax'],
+                    'text':df_by_date['Province_State'],
+                    'customdata':df_by_date['number'],
+                    'autocolorscale':false,
+                    'colorscale':colorscale,
+                    'showscale':false
+                })
+        } else {
+            var customdata=df_by_date['iso3'].map(x => x=='USA' ? 'USA' : 'World')
+            if (graph.includes('scatter'))
+                traces.push({
+                    'type':'scattergeo',
+                    'locations':df_by_date['iso3'],
+                    'locationmode':'ISO-3',
+                    'text':df_by_date['Country/Region'],
+                    'customdata':customdata,
+                    'marker':{'size':df_by_date[data].map(x => x*scale['size']/2000),'sizemode':'area','color':'red'}
+                })
+            if (graph.includes('choropleth'))
+                traces.push({
+                    'type':'choropleth',
+                    'locations':df_by_date['iso3'],
+                    'locationmode':'ISO-3',
+                    'z':z,
+                    'zmin':0,
+                    'zmax':scale['zmax'],
+                    'text':df_by_date['Country/Region'],
+                    'customdata':customdata,
+                    'autocolorscale':false,
+                    'colorscale':colorscale,
+                    'showscale':false
+                })
+        }
+        return {
+            'data': traces,
+            'layout': {
+                'margin':{'l':0,'r':0,'t':0,'b':0,'pad':0},
+                'uirevision':true,
+                'geo':{'margin':{'l':0,'r':0,'t':0,'b':0,'pad':0},
+                       'uirevision':true,
+                       'showland':true,
+                       'landcolor':'#dddddd',
+                       'showcountries':true,
+                       'fitbounds':'geojson',
+                       'showframe': false,
+                       'showcoastlines': true},
+                'hovermode':'closest'
+            }
         }
     }
+    """.replace('SCALES', json.dumps(SCALES)),
+    Output('graph-with-slider', 'figure'),
+   [Input('date', 'data'),
+    Input('locations', 'data'),
+    Input('geojson', 'data'),
+    Input('date-slider', 'value'),
+    Input('select-graph', 'value'),
+    Input('select-data', 'value')]
+)
 
 app.clientside_callback(
     """
@@ -378,5 +404,71 @@ app.clientside_callback(
     [Input('graph-with-slider', 'clickData')]
 )
 
+# Play steps the slider through its marks and wraps around at the end.
+app.clientside_callback(
+    """
+    function(n_clicks, disabled) {
+        return n_clicks ? [!disabled, disabled ? 'Pause' : 'Play'] : [true, 'Play']
+    }
+    """,
+    [Output('play-interval', 'disabled'),
+     Output('play', 'children')],
+    [Input('play', 'n_clicks')],
+    [State('play-interval', 'disabled')]
+)
+
+app.clientside_callback(
+    """
+    function(n_intervals, value, marks) {
+        if (!n_intervals)
+            return window.dash_clientside.no_update
+        var ticks=Object.keys(marks).map(Number).sort((a, b) => a-b)
+        return ticks[(ticks.indexOf(value)+1) % ticks.length]
+    }
+    """,
+    Output('date-slider', 'value'),
+    [Input('play-interval', 'n_intervals')],
+    [State('date-slider', 'value'),
+     State('date-slider', 'marks')]
+)
+
+server.register_blueprint(api.blueprint(lambda: refresher.frames))
+
+# Responses of the memoized callbacks, encoded once per data version.
+responses.Callbacks(server, ['date.data', 'range.data', 'locations.data', 'location.data', 'geojson.data'],
+                    lambda: refresher.frames.version)
+# Registered after responses.Callbacks so that Flask, which runs after_request
+# hooks last registered first, records the callback's own response before it
+# is compressed.
+server.after_request(metrics.after_request)
+refresher.on_swap.append(lambda frames: responses.bodies.drop(frames.version))
+
+warmup_report=None
+if warmup.WARMUP:
+    callbacks={'df_range' if PREFETCH else 'df_date':df_range if PREFETCH else df_date,
+               'df_locations':df_locations, 'df_geojson':df_geojson, 'df_location':df_location}
+    ticks=[unixTimeMillis(date) for date in refresher.frames.df['date'].drop_duplicates()]
+    warmup_report=warmup.run(server, cache, callbacks, ticks)
+
+@server.route('/data-version')
+def data_version():
+    return flask.jsonify(refresher.status())
+
+# Dates where the county sums disagree with the country-level USA row.
+@server.route('/consistency')
+def consistency():
+    return flask.jsonify(refresher.frames.consistency)
+
+# Callback timings, response sizes and cache results of the answering worker.
+@server.route('/metrics')
+def prometheus():
+    return flask.Response(metrics.registry.render(), content_type=metrics.CONTENT_TYPE)
+
+@server.route('/cache-stats')
+def cache_stats():
+    return flask.jsonify({'backend':CACHE_CONFIG['CACHE_TYPE'], 'pid':os.getpid(), 'callbacks':memo.stats.report(), 'warmup':warmup_report,
+                          'responses':responses.bodies.report()})
+
 if __name__ == '__main__':
+    refresher.start()
     app.run_server(debug=False)
\ No newline at end of file
@@ -0,0 +1,53 @@
+// Helpers shared by the clientside callbacks in app.py.
+window.coronavirus = (function() {
+    var MISSING = -2147483648
+    var cache = {}
+
+    // a plotly typed-array spec ({dtype, bdata}) as a plain array
+    function decode(spec) {
+        var binary = atob(spec['bdata'])
+        var bytes = new Uint8Array(binary.length)
+        for (var i = 0; i < binary.length; i++)
+            bytes[i] = binary.charCodeAt(i)
+        return Array.from(spec['dtype'] == 'f8' ? new Float64Array(bytes.buffer) : new Int32Array(bytes.buffer))
+    }
+
+    // the binary df_date payload plus the area's location attributes, in the
+    // column-lists shape of DataFrame.to_dict('list')
+    function expand(payload, attributes) {
+        var codes = decode(payload['loc'])
+        var result = {}
+        for (var col in attributes)
+            result[col] = codes.map(i => attributes[col][i])
+        for (var key in payload)
+            if (key != 'loc' && typeof payload[key] == 'object')
+                result[key] = decode(payload[key])
+        return result
+    }
+
+    // one date of the prefetched dates x locations matrices, same shape as expand
+    function frame(range, i) {
+        var metric = range['metric']
+        var columns = range['columns'] || [metric, metric + '_rate']
+        var key = [range['version'], range['area'], metric].join('|')
+        if (cache.key !== key)
+            cache = {key: key, values: columns.map(col => decode(range[col]))}
+        var result = {}
+        for (var col in range['attributes'])
+            result[col] = []
+        columns.forEach(col => result[col] = [])
+        if (i < 0)
+            return result
+        var n = range['shape'][1]
+        for (var j = 0; j < n; j++) {
+            if (cache.values[0][i*n+j] === MISSING)
+                continue
+            for (var col in range['attributes'])
+                result[col].push(range['attributes'][col][j])
+            columns.forEach((col, k) => result[col].push(cache.values[k][i*n+j]))
+        }
+        return result
+    }
+
+    return {decode: decode, expand: expand, frame: frame}
+})()
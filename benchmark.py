@@ -0,0 +1,777 @@
+import os
+import gc
+import ctypes
+import sys
+import json
+import time
+import argparse
+import tempfile
+import shutil
+import zlib
+import subprocess
+import threading
+import http.server
+from urllib.request import urlopen
+import numpy as np
+import pandas as pd
+from plotly.utils import PlotlyJSONEncoder
+import pipeline
+import ingest
+import snapshot
+import store
+import geo
+import schema
+import fetch
+import loadtest
+
+# Writes a directory laid out like the JHU csse_covid_19_data folder (plus a
+# counties GeoJSON) so the pipeline can be timed without network access.
+def write_mirror(path, countries=180, counties=3000, days=280, seed=0):
+    rng=np.random.default_rng(seed)
+    dates=pd.date_range('2020-01-22', periods=days)
+    date_columns=[f'{d.month}/{d.day}/{d.year%100}' for d in dates]
+    states=list(pipeline.abbreviations.items())
+
+    iso3=['USA']+[''.join(chr(65+(i//26**k)%26) for k in (2, 1, 0)) for i in range(countries-1)]
+    names=['US']+[f'Country {x}' for x in iso3[1:]]
+    country_population=rng.integers(100000, 100000000, countries)
+    fips=np.array([int(states[i%len(states)][1][0])*1000+i//len(states)+1 for i in range(counties)])
+    county_state=[states[i%len(states)][0] for i in range(counties)]
+    county_population=rng.integers(1000, 1000000, counties)
+
+    # one country reported per province as well, like Canada/China upstream
+    iso3.append(iso3[1])
+    names.append(names[1])
+    provinces=[np.nan]*countries+[f'Province {iso3[1]}']
+    countries+=1
+    country_population=np.append(country_population, rng.integers(100000, 1000000))
+    lookup=pd.DataFrame({
+        'UID':range(countries+counties),
+        'iso2':[x[:2] for x in iso3]+['US']*counties,
+        'iso3':iso3+['USA']*counties,
+        'code3':[840]*(countries+counties),
+        'FIPS':[np.nan]*countries+list(fips),
+        'Admin2':[np.nan]*countries+[f'County {x:05d}' for x in fips],
+        'Province_State':provinces+county_state,
+        'Country_Region':names+['US']*counties,
+        'Lat':rng.uniform(-60, 70, countries+counties),
+        'Long_':rng.uniform(-180, 180, countries+counties),
+        'Combined_Key':names+[f'County {x:05d}, {s}, US' for x, s in zip(fips, county_state)],
+        'Population':list(country_population)+list(county_population),
+    })
+    os.makedirs(os.path.join(path, 'csse_covid_19_time_series'), exist_ok=True)
+    lookup.to_csv(os.path.join(path, 'UID_ISO_FIPS_LookUp_Table.csv'), index=False)
+
+    def series(rows, scale):
+        return pd.DataFrame(np.cumsum(rng.poisson(scale, (rows, days)), axis=1), columns=date_columns)
+
+    for var_name, scale in [('confirmed', 20), ('deaths', 1), ('recovered', 10)]:
+        ts=pd.DataFrame({'Province/State':provinces, 'Country/Region':names,
+                         'Lat':lookup['Lat'][:countries], 'Long':lookup['Long_'][:countries]})
+        pd.concat([ts, series(countries, scale)], axis=1).to_csv(
+            os.path.join(path, f'csse_covid_19_time_series/time_series_covid19_{var_name}_global.csv'), index=False)
+        if var_name=='recovered':
+            continue
+        ts=lookup[countries:].drop(columns=['Population']).reset_index(drop=True)
+        if var_name=='deaths':
+            ts['Population']=county_population
+        pd.concat([ts, series(counties, scale/10)], axis=1).to_csv(
+            os.path.join(path, f'csse_covid_19_time_series/time_series_covid19_{var_name}_US.csv'), index=False)
+
+    features=[]
+    for x, state in zip(fips, county_state):
+        lat, lon=rng.uniform(25, 48), rng.uniform(-124, -67)
+        features.append({'type':'Feature', 'id':f'{x:05d}',
+                         'properties':{'STATE':f'{x:05d}'[:2], 'COUNTY':f'{x:05d}'[2:], 'NAME':f'County {x:05d}'},
+                         'geometry':{'type':'Polygon', 'coordinates':[[[lon, lat], [lon+0.5, lat], [lon+0.5, lat+0.5], [lon, lat+0.5], [lon, lat]]]}})
+    with open(os.path.join(path, 'geojson-counties-fips.json'), 'w') as f:
+        json.dump({'type':'FeatureCollection', 'features':features}, f)
+    return 'file://'+os.path.abspath(path)+'/', 'file://'+os.path.abspath(os.path.join(path, 'geojson-counties-fips.json'))
+
+# Adds one more date column to every time series in a mirror, the way the
+# upstream files grow each day, and optionally revises an earlier cell.
+def append_day(path, revise=True, seed=1):
+    rng=np.random.default_rng(seed)
+    for source in pipeline.SOURCES.values():
+        ts=pd.read_csv(os.path.join(path, source), float_precision='round_trip')
+        last=pd.to_datetime(ts.columns[-1])
+        day=last+pd.Timedelta(days=1)
+        ts[f'{day.month}/{day.day}/{day.year%100}']=ts[ts.columns[-1]]+rng.poisson(5, len(ts))
+        if revise:
+            ts.iloc[0, -3]+=1
+        ts.to_csv(os.path.join(path, source), index=False)
+
+def timed(fn, *args, **kwargs):
+    start=time.perf_counter()
+    result=fn(*args, **kwargs)
+    return result, time.perf_counter()-start
+
+def bench_startup(input_url, counties_url, workdir):
+    _, live=timed(lambda: (pipeline.load_frames(input_url), pipeline.load_geo(counties_url)))
+    path=os.path.join(workdir, 'snapshot')
+    _, build=timed(snapshot.build, path, input_url, counties_url)
+    _, load=timed(snapshot.read, path)
+    return {'import_path_s':live, 'snapshot_build_s':build, 'snapshot_load_s':load}
+
+def memory_usage():
+    usage=dict()
+    with open('/proc/self/smaps_rollup') as f:
+        for line in f:
+            parts=line.split()
+            if len(parts)==3 and parts[2]=='kB':
+                usage[parts[0].rstrip(':')]=int(parts[1])*1024
+    with open('/proc/self/status') as f:
+        peak=next(int(line.split()[1])*1024 for line in f if line.startswith('VmHWM:'))
+    return {'rss':usage['Rss'], 'pss':usage['Pss'], 'private':usage['Private_Clean']+usage['Private_Dirty'],
+            'dirty':usage['Private_Dirty'], 'peak':peak}
+
+# The same slicing the df_date/df_location callbacks do.
+def workload(df, df_states, df_us):
+    for date in df['date'].unique()[::7]:
+        df.query('date==@date').to_dict('list')
+        df_states.query('date==@date').to_dict('list')
+        df_us.query('number=="48"').query('date==@date').to_dict('list')
+    for temp, key in [(df, 'iso3'), (df_states, 'abbreviation'), (df_us, 'FIPS')]:
+        temp.groupby(key)[['date', 'confirmed']].apply(lambda x: x.values.T.tolist()).to_dict()
+
+def fork_workers(workers, load):
+    results=[]
+    for _ in range(workers):
+        read_end, write_end=os.pipe()
+        if os.fork()==0:
+            os.close(read_end)
+            frames=load()[:3]
+            idle=memory_usage()
+            workload(*frames)
+            ctypes.CDLL(None).malloc_trim(0)
+            busy=memory_usage()
+            os.write(write_end, json.dumps({f'idle_{k}':v for k, v in idle.items()}|{f'busy_{k}':v for k, v in busy.items()}).encode())
+            os._exit(0)
+        os.close(write_end)
+        with os.fdopen(read_end) as f:
+            results.append(json.loads(f.read()))
+        os.wait()
+    return {key:sum(x[key] for x in results)/len(results)/2**20 for key in results[0]}
+
+# Time per stage of a load from the CSVs: per source the parse, the widening
+# and the melt to long rows (transform_and_standardize*), then building the
+# frames from the wide matrices with each engine.
+def bench_transform(input_url, counties_url, workdir):
+    files=fetch.fetch(pipeline.source_urls(input_url))
+    df_lookup, lookup_s=timed(pd.read_csv, files[input_url+pipeline.LOOKUP].path)
+    result={'lookup_read_s':lookup_s}
+    wide=dict()
+    for name, source in pipeline.SOURCES.items():
+        raw, read_s=timed(pd.read_csv, files[input_url+source].path)
+        if name.endswith('_us'):
+            wide[name], widen_s=timed(pipeline.widen_us, raw, name[:-3])
+            long, transform_s=timed(pipeline.transform_and_standardize_us, raw, name[:-3])
+        else:
+            wide[name], widen_s=timed(pipeline.widen, raw, df_lookup)
+            long, transform_s=timed(pipeline.transform_and_standardize, raw, name, df_lookup)
+        result[name]={'rows':len(raw), 'columns':raw.shape[1], 'read_s':read_s, 'widen_s':widen_s,
+                      'transform_s':transform_s, 'long_rows':len(long)}
+    for engine in ['pandas', 'dense']:
+        _, result[f'build_{engine}_s']=timed(pipeline.build_frames, df_lookup, wide, engine)
+    return result
+
+# Run in a fresh interpreter by bench_memory, so the peak RSS is the stage's
+# own: building the frames from the CSVs with either engine, or reading a
+# snapshot.
+def peak_worker(stage, input_url, path):
+    start=time.perf_counter()
+    if stage=='snapshot':
+        snapshot.read(path)
+    else:
+        pipeline.build_frames(*pipeline.load_wide(input_url), stage)
+    return {'seconds':time.perf_counter()-start, 'peak_mb':memory_usage()['peak']/2**20}
+
+# The callbacks' reads of the World and USA areas of a Refresher's bundle:
+# the rows of every 7th date and the series of every metric.
+def serve(refresher):
+    for area in [refresher.frames.areas.get(name) for name in ['World', 'USA']]:
+        for start, stop in list(area.dates.values())[::7]:
+            schema.rows(area.facts, area.dimension, start, stop)
+        for col in area.timeline.values:
+            store.payload(area.timeline, col)
+    gc.collect()
+    ctypes.CDLL(None).malloc_trim(0)
+    return memory_usage()
+
+# Workers forked from a preloaded Refresher, one at a time, each serving
+# before and after swapping with check() to each of `versions` in turn. The
+# first swap's allocations partly reuse the pages the old bundle leaves, so
+# the second shows the cost of every later refresh.
+def swap_workers(workers, refresher, versions):
+    results=[]
+    for _ in range(workers):
+        read_end, write_end=os.pipe()
+        if os.fork()==0:
+            os.close(read_end)
+            usage={'before':serve(refresher)}
+            for i, version in enumerate(versions):
+                with open(os.path.join(refresher.path, 'CURRENT'), 'w') as f:
+                    f.write(version)
+                refresher.check()
+                usage[f'swap{i+1}']=serve(refresher)
+            os.write(write_end, json.dumps({f'{stage}_{k}':usage[stage][k] for stage in usage for k in ['pss', 'dirty']}).encode())
+            os._exit(0)
+        os.close(write_end)
+        with os.fdopen(read_end) as f:
+            results.append(json.loads(f.read()))
+        os.wait()
+    return {key:sum(x[key] for x in results)/len(results)/2**20 for key in results[0]}
+
+def bench_memory(input_url, counties_url, workdir, workers=4):
+    path=os.path.join(workdir, 'snapshot')
+    snapshot.build(path, input_url, counties_url)
+    result={'peak':{stage:subprocess_json(f'benchmark.peak_worker({stage!r}, {input_url!r}, {path!r})')
+                    for stage in ['pandas', 'dense', 'snapshot']}}
+    result['per_worker_build_mb']=fork_workers(workers, lambda: pipeline.load_frames(input_url))
+    frames=pipeline.load_frames(input_url)
+    gc.freeze()
+    result['preload_mb']=fork_workers(workers, lambda: frames)
+    frames=snapshot.read(path)
+    gc.freeze()
+    result['preload_snapshot_mb']=fork_workers(workers, lambda: frames)
+    # refreshes to snapshots with the served areas, which are memory-mapped,
+    # and to snapshots without them, which every worker builds on its own heap
+    import refresh
+    refresher=refresh.Refresher(path, 0)
+    gc.freeze()
+    versions=[snapshot.build(path, input_url, counties_url, keep=5) for _ in range(4)]
+    for version in versions[2:]:
+        shutil.rmtree(os.path.join(path, version, 'served'))
+    result['refresh_mb']=swap_workers(workers, refresher, versions[:2])
+    result['refresh_built_mb']=swap_workers(workers, refresher, versions[2:])
+    return result
+
+def bench_ingest(input_url, counties_url, workdir):
+    path=os.path.join(workdir, 'snapshot')
+    snapshot.build(path, input_url, counties_url)
+    append_day(input_url[len('file://'):])
+    (_, rows), incremental=timed(ingest.ingest, path, input_url, counties_url)
+    _, full=timed(snapshot.build, path, input_url, counties_url)
+    return {'rows_patched':rows, 'incremental_s':incremental, 'full_rebuild_s':full}
+
+# Mean df_date latency over every date, the old DataFrame.query lookup against
+# the per-(area, date) row ranges.
+def bench_df_date(input_url, counties_url, workdir):
+    path=os.path.join(workdir, 'snapshot')
+    snapshot.build(path, input_url, counties_url)
+    df, df_states, df_us, df_geo=snapshot.read(path)
+    df, df_states, df_us, dates, _, _=store.prepare(df, df_states, df_us)
+    result=dict()
+    for area, temp in [('World', df), ('USA', df_states), ('48', df_us)]:
+        days=df['date'].drop_duplicates()
+        def query():
+            for date_parsed in days:
+                selected=temp if area in ('World', 'USA') else temp.query('number==@area')
+                selected.query('date==@date_parsed').to_dict('list')
+        def indexed():
+            for date_parsed in days:
+                start, stop=dates.get(area, {}).get(date_parsed.value, (0, 0))
+                temp.iloc[start:stop].to_dict('list')
+        result[area]={'query_ms':timed(query)[1]/len(days)*1000, 'indexed_ms':timed(indexed)[1]/len(days)*1000}
+    return result
+
+# Data prep per exporter frame: the query() scans coronavirus.py and covid.py
+# did for every date against a lookup in the store.by_date partitions, which
+# are built once per export.
+def bench_frames(input_url, counties_url, workdir, area='48'):
+    path=os.path.join(workdir, 'snapshot')
+    snapshot.build(path, input_url, counties_url)
+    df, df_states, df_us, df_geo=snapshot.read(path)
+    days=df_us['date'].unique()
+    def query(number=area):
+        for date_parsed in days:
+            df_states.query('date==@date_parsed').to_dict('list')
+            df_us.query('date==@date_parsed').to_dict('list')
+            df_us.query('number==@number').query('date==@date_parsed').to_dict('list')
+    def build():
+        return (store.by_date(df_states, ['abbreviation', 'Province_State', 'number', 'confirmed_rate']),
+                store.by_date(df_us, ['Lat', 'Long_', 'Province_State', 'number', 'confirmed']),
+                store.by_date(df_us[df_us['number']==area], ['Lat', 'Long_', 'Admin2', 'FIPS', 'confirmed', 'confirmed_rate']))
+    partitions, build_seconds=timed(build)
+    def lookup():
+        for date_parsed in days:
+            for partition in partitions:
+                partition[pd.Timestamp(date_parsed).value]
+    return {'frames':len(days), 'query_ms_per_frame':timed(query)[1]/len(days)*1000,
+            'by_date_build_ms':build_seconds*1000, 'by_date_ms_per_frame':timed(lookup)[1]/len(days)*1000}
+
+# df_location payload size (as Dash serializes it) and time, the groupby over
+# the whole frame against the precomputed per-area matrices.
+def bench_df_location(input_url, counties_url, workdir):
+    path=os.path.join(workdir, 'snapshot')
+    snapshot.build(path, input_url, counties_url)
+    df, df_states, df_us, df_geo=snapshot.read(path)
+    (df, df_states, df_us, dates, timelines, _), prepare=timed(store.prepare, df, df_states, df_us)
+    result={'prepare_s':prepare}
+    for area, temp, key in [('World', df, 'iso3'), ('USA', df_states, 'abbreviation'), ('48', df_us, 'FIPS')]:
+        old, old_s=timed(lambda: temp.groupby(key)[['date', 'confirmed']].apply(lambda x: x.values.T.tolist()).to_dict())
+        new, new_s=timed(store.payload, timelines[area], 'confirmed')
+        result[area]={'groupby_bytes':len(json.dumps(old, cls=PlotlyJSONEncoder)), 'groupby_ms':old_s*1000,
+                      'precomputed_bytes':len(json.dumps(new, cls=PlotlyJSONEncoder)), 'precomputed_ms':new_s*1000}
+    return result
+
+# df_date response bytes and time per slider tick, to_dict('list') JSON against
+# typed arrays plus the per-area location attributes (sent once per area).
+def bench_wire(input_url, counties_url, workdir):
+    path=os.path.join(workdir, 'snapshot')
+    snapshot.build(path, input_url, counties_url)
+    df, df_states, df_us, dates, timelines, locations=store.prepare(*snapshot.read(path)[:3])
+    result=dict()
+    for area, temp in [('World', df), ('USA', df_states), ('48', df_us)]:
+        runs=list(dates[area].values())
+        # the cumulative metrics, as df_date sends them
+        names=[col for metric in store.METRICS for col in store.columns(metric) if col in temp]
+        temp=temp[[col for col in temp if col in names or col not in store.values(temp)]]
+        (json_bytes, json_s)=timed(lambda: sum(len(json.dumps(temp.iloc[a:b].to_dict('list'), cls=PlotlyJSONEncoder)) for a, b in runs))
+        (binary_bytes, binary_s)=timed(lambda: sum(len(json.dumps(store.binary_rows(temp, a, b, locations[area], names))) for a, b in runs))
+        result[area]={'json_bytes':json_bytes/len(runs), 'json_ms':json_s/len(runs)*1000,
+                      'binary_bytes':binary_bytes/len(runs), 'binary_ms':binary_s/len(runs)*1000,
+                      'locations_bytes':len(json.dumps(locations[area].attributes))}
+    return result
+
+def dash_request(client, output, inputs, changed):
+    body={'output':f'{output[0]}.{output[1]}', 'outputs':{'id':output[0], 'property':output[1]},
+          'inputs':[{'id':key, 'property':prop, 'value':value} for key, prop, value in inputs],
+          'changedPropIds':[changed], 'state':[]}
+    response=client.post('/_dash-update-component', json=body)
+    assert response.status_code==200, response.data[:200]
+    return len(json.dumps(body)), len(response.data), response.get_json()['response'][output[0]][output[1]]
+
+# Drives the Dash endpoint the way a browser scrubbing the date slider does and
+# reports the server requests, bytes and throughput per slider tick.
+# The app serving the snapshot at path. The module is imported once per
+# process, so a later call only picks up the newest version there.
+def load_app(path):
+    snapshot.SNAPSHOT_DIR=path
+    import app
+    app.refresher.path=path
+    app.refresher.check()
+    return app
+
+def bench_scrub(input_url, counties_url, workdir, area='48'):
+    path=os.path.join(workdir, 'snapshot')
+    snapshot.build(path, input_url, counties_url)
+    app=load_app(path)
+    client=app.server.test_client()
+    client.get('/')
+    ticks=[app.unixTimeMillis(date) for date in app.refresher.frames.df['date'].drop_duplicates()]
+    _, _, geojson=dash_request(client, ('geojson', 'data'), [('select-area', 'value', area), ('zoom', 'data', 1)], 'select-area.value')
+    _, _, locations=dash_request(client, ('locations', 'data'), [('select-area', 'value', area)], 'select-area.value')
+    server=lambda output: 'callback' in app.app.callback_map.get(output, {})
+    requests, sent, received=0, 0, 0
+    start=time.perf_counter()
+    if server('range.data'):
+        up, down, _=dash_request(client, ('range', 'data'), [('select-data', 'value', 'confirmed'), ('select-area', 'value', area)], 'select-area.value')
+        requests, sent, received=requests+1, sent+up, received+down
+    for tick in ticks:
+        date=None
+        if server('date.data'):
+            up, down, date=dash_request(client, ('date', 'data'), [('date-slider', 'value', tick), ('select-area', 'value', area),
+                                                                        ('select-data', 'value', 'confirmed')], 'date-slider.value')
+            requests, sent, received=requests+1, sent+up, received+down
+        if server('graph-with-slider.figure'):
+            up, down, _=dash_request(client, ('graph-with-slider', 'figure'), [
+                ('date', 'data', date), ('locations', 'data', locations),
+                ('geojson', 'data', geojson), ('date-slider', 'value', tick),
+                ('select-graph', 'value', ['choropleth', 'scatter']), ('select-data', 'value', 'confirmed')], 'date.data')
+            requests, sent, received=requests+1, sent+up, received+down
+    elapsed=time.perf_counter()-start
+    return {'server_requests_per_tick':requests/len(ticks), 'bytes_up_per_tick':sent/len(ticks),
+            'bytes_down_per_tick':received/len(ticks), 'bytes_down_per_scrub':received,
+            'server_ms_per_tick':elapsed/len(ticks)*1000, 'ticks_per_s':len(ticks)/elapsed}
+
+# Each server-side callback through the Dash endpoint, for World, USA and one
+# state: the mean latency over all its inputs with an empty cache (misses)
+# and again (hits), and the mean response size.
+def bench_callbacks(input_url, counties_url, workdir, areas=('World', 'USA', '48')):
+    path=os.path.join(workdir, 'snapshot')
+    snapshot.build(path, input_url, counties_url)
+    app=load_app(path)
+    client=app.server.test_client()
+    client.get('/')
+    ticks=[app.unixTimeMillis(date) for date in app.refresher.frames.df['date'].drop_duplicates()]
+    metrics=[name for metric in store.METRICS for name in store.series(metric)]
+    server=lambda output: 'callback' in app.app.callback_map.get(output, {})
+    calls={
+        'date.data':lambda area: [[('date-slider', 'value', tick), ('select-area', 'value', area), ('select-data', 'value', 'confirmed')]
+                                  for tick in ticks],
+        'range.data':lambda area: [[('select-data', 'value', metric), ('select-area', 'value', area)] for metric in metrics],
+        'location.data':lambda area: [[('select-data', 'value', metric), ('select-area', 'value', area)] for metric in metrics],
+        'locations.data':lambda area: [[('select-area', 'value', area)]],
+        'geojson.data':lambda area: [[('select-area', 'value', area), ('zoom', 'data', zoom)] for zoom in [1, 2, 4, 8, 16]],
+    }
+    app.cache.clear()
+    result=dict()
+    for output, inputs in calls.items():
+        if not server(output):
+            continue
+        result[output]=dict()
+        for area in areas:
+            requests=inputs(area)
+            target=tuple(output.split('.'))
+            def run():
+                return sum(dash_request(client, target, request, f'{request[0][0]}.{request[0][1]}')[1] for request in requests)
+            received, cold=timed(run)
+            _, warm=timed(run)
+            result[output][area]={'requests':len(requests), 'cold_ms':cold/len(requests)*1000,
+                                  'warm_ms':warm/len(requests)*1000, 'bytes':received/len(requests)}
+    return result
+
+# loadtest.run against the app served by a threaded werkzeug server in this
+# process: concurrent visitors scrubbing, switching areas and metrics, with no
+# think time.
+def bench_load(input_url, counties_url, workdir, visitors=8, duration=10):
+    from werkzeug.serving import make_server, WSGIRequestHandler
+    path=os.path.join(workdir, 'snapshot')
+    snapshot.build(path, input_url, counties_url)
+    app=load_app(path)
+    app.cache.clear()
+    quiet=type('Quiet', (WSGIRequestHandler,), {'log_request':lambda self, *args: None})
+    server=make_server('127.0.0.1', 0, app.server, threaded=True, request_handler=quiet)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    try:
+        return loadtest.run(f'http://127.0.0.1:{server.server_port}', visitors, duration)
+    finally:
+        server.shutdown()
+
+# The body of a test client response, decoded.
+def decoded(response):
+    encoding=response.headers.get('Content-Encoding')
+    if encoding=='br':
+        import brotli
+        return brotli.decompress(response.data)
+    return zlib.decompress(response.data, 16+zlib.MAX_WBITS) if encoding=='gzip' else response.data
+
+# A link of 50 ms round trip and 10 Mbit/s, for estimating render times.
+LINK = {'rtt_s':0.05, 'bytes_per_s':10e6/8}
+
+# What the first render of a county view (with the real shapes of
+# map.geojson) costs in requests, bytes on the wire and server time. 'inline'
+# is the shapes sent in the df_geojson response and gzipped per request, as
+# before the geometry URLs. 'cold' has empty server caches, 'other_visitor'
+# warm ones, and 'revisit' also has the shapes in the browser cache. The
+# render time is estimated over LINK: the callbacks run in parallel, and the
+# shapes are fetched once df_geojson has answered.
+def bench_http(input_url, counties_url, workdir, area='48', link=LINK):
+    shapes=os.path.join(workdir, 'counties.json')
+    with open(shapes, 'w') as f:
+        json.dump(real_counties(), f)
+    path=os.path.join(workdir, 'snapshot')
+    snapshot.build(path, input_url, 'file://'+shapes)
+    app=load_app(path)
+    app.cache.clear()
+    client=app.server.test_client()
+    client.get('/')
+    tick=app.unixTimeMillis(app.refresher.frames.df['date'].max())
+    requests=[(('locations', 'data'), [('select-area', 'value', area)]),
+              (('geojson', 'data'), [('select-area', 'value', area), ('zoom', 'data', 1)]),
+              (('location', 'data'), [('select-data', 'value', 'confirmed'), ('select-area', 'value', area)])]
+    if 'callback' in app.app.callback_map.get('range.data', {}):
+        requests.append((('range', 'data'), [('select-data', 'value', 'confirmed'), ('select-area', 'value', area)]))
+    else:
+        requests.append((('date', 'data'), [('date-slider', 'value', tick), ('select-area', 'value', area), ('select-data', 'value', 'confirmed')]))
+    headers={'Accept-Encoding':'br, gzip'}
+    def transfer(seconds, size):
+        return link['rtt_s']+seconds+size/link['bytes_per_s']
+    def visit(geometry=True):
+        costs=dict()
+        for output, inputs in requests:
+            body={'output':'.'.join(output), 'outputs':{'id':output[0], 'property':output[1]},
+                  'inputs':[{'id':key, 'property':prop, 'value':value} for key, prop, value in inputs],
+                  'changedPropIds':[f'{inputs[0][0]}.{inputs[0][1]}'], 'state':[]}
+            response, seconds=timed(client.post, '/_dash-update-component', json=body, headers=headers)
+            costs[output[0]]=(seconds, len(response.data))
+            if output[0]=='geojson':
+                url=json.loads(decoded(response))['response']['geojson']['data']['url']
+        if geometry:
+            response, seconds=timed(client.get, url, headers=headers)
+            costs['shapes']=(seconds, len(response.data))
+        return costs
+    def report(costs):
+        callbacks=max(transfer(*cost) for name, cost in costs.items() if name!='shapes')
+        shapes=transfer(*costs['geojson'])+transfer(*costs['shapes']) if 'shapes' in costs else 0
+        return {'requests':len(costs), 'bytes':sum(size for _, size in costs.values()),
+                'server_ms':sum(seconds for seconds, _ in costs.values())*1000,
+                'first_render_ms':max(callbacks, shapes)*1000}
+    result={'link':link}
+    cold=visit()
+    # the shapes inline: the Dash response encoded and gzipped on every request
+    level=geo.choose(app.refresher.frames.spans[area])
+    inline, inline_s=timed(lambda: zlib.compress(json.dumps(
+        {'multi':True, 'response':{'geojson':{'data':app.refresher.frames.areas.geojson(area, level)}}},
+        cls=PlotlyJSONEncoder).encode(), 6))
+    result['inline']=report({**{name:cost for name, cost in cold.items() if name!='shapes'},
+                             'geojson':(cold['geojson'][0]+inline_s, len(inline))})
+    result['cold']=report(cold)
+    result['other_visitor']=report(visit())
+    result['revisit']=report(visit(geometry=False))
+    return result
+
+# The query API: requests per second of each query shape through the test
+# client, and the full county export streamed (MB/s once the states are
+# loaded, and the traced peak while reading it chunk by chunk against the
+# same rows as one buffered body).
+def bench_api(input_url, counties_url, workdir, repeat=200):
+    import tracemalloc
+    path=os.path.join(workdir, 'snapshot')
+    snapshot.build(path, input_url, counties_url)
+    app=load_app(path)
+    client=app.server.test_client()
+    frames=app.refresher.frames
+    rng=np.random.default_rng(0)
+    countries=frames.areas.get('World').timeline.labels
+    states=frames.areas.get('USA').timeline.labels
+    counties=[label for number in sorted(frames.areas.get('USA').dimension['number'].astype(str).unique())
+              for label in frames.areas.get(number).timeline.labels]
+    dates=frames.areas.get('World').timeline.dates
+    queries={'series':lambda: f'/api/v1/series?ids={rng.choice(countries)},{rng.choice(states)},{rng.choice(counties)}&metrics=confirmed,deaths_new',
+             'series_range':lambda: f'/api/v1/series?ids={rng.choice(counties)}&start={dates[len(dates)//2]}',
+             'section':lambda: f'/api/v1/section?level=state&date={rng.choice(dates)}',
+             'section_county':lambda: f'/api/v1/section?level=county&offset={rng.integers(len(counties))}&limit=100',
+             'locations':lambda: '/api/v1/locations?level=county&limit=1000'}
+    result=dict()
+    for name, query in queries.items():
+        urls=[query() for _ in range(repeat)]
+        client.get(urls[0])
+        sizes=[]
+        start=time.perf_counter()
+        for url in urls:
+            response=client.get(url)
+            assert response.status_code==200, (url, response.data)
+            sizes.append(len(response.data))
+        seconds=time.perf_counter()-start
+        result[name]={'requests_per_s':repeat/seconds, 'mean_ms':seconds/repeat*1000, 'bytes':np.mean(sizes)}
+    for format in ['csv', 'jsonl']:
+        url=f'/api/v1/export?level=county&format={format}'
+        def stream():
+            response=client.get(url, buffered=False)
+            sizes=[len(chunk) for chunk in response.response]
+            response.close()
+            return sizes
+        stream()
+        sizes, seconds=timed(stream)
+        size, chunks=sum(sizes), len(sizes)
+        gc.collect()
+        tracemalloc.start()
+        stream()
+        _, streamed=tracemalloc.get_traced_memory()
+        tracemalloc.reset_peak()
+        whole=len(client.get(url).data)
+        _, buffered=tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        assert whole==size
+        result[f'export_{format}']={'bytes':size, 'chunks':chunks, 'seconds':seconds, 'mb_per_s':size/seconds/1e6,
+                                    'streamed_peak_mb':streamed/1e6, 'buffered_peak_mb':buffered/1e6}
+    return result
+
+# Per state, the county shapes shipped in map.geojson at each detail level:
+# JSON and gzipped size, vertices, time to serialize, and the level the app
+# picks for the fitted map.
+# The county shapes of map.geojson, keyed like the upstream file.
+def real_counties():
+    with open(os.path.join(snapshot.ROOT, 'map.geojson')) as f:
+        counties=json.load(f)
+    for county in counties['features']:
+        # ids and states are partly ints in this file, the upstream one has zero-padded strings
+        county['id']=county['properties']['GEO_ID'][-5:]
+        county['properties']['STATE']=county['id'][:2]
+    return counties
+
+def bench_geo(input_url, counties_url, workdir):
+    df_geo=pipeline.split_counties(real_counties())
+    levels, seconds=timed(geo.levels, df_geo)
+    levels['full']=df_geo
+    spans=geo.spans(df_geo)
+    result={'simplify_s':seconds}
+    for area in sorted(df_geo):
+        result[area]={'chosen':geo.choose(spans[area])}
+        for name, level in levels.items():
+            text, dumps=timed(json.dumps, level[area])
+            points=sum(len(ring) for feature in level[area]['features'] for polygon in geo.rings(feature['geometry']) for ring in polygon)
+            result[area][name]={'bytes':len(text), 'gzip_bytes':len(zlib.compress(text.encode(), 6)), 'points':points, 'dumps_ms':dumps*1000}
+    return result
+
+# End-to-end load (CSV reads, widening and the long frames) with the melt and
+# merge path against the dense engine, plus the frame building alone.
+def bench_engine(input_url, counties_url, workdir):
+    result=dict()
+    for engine in ['pandas', 'dense']:
+        (df_lookup, wide), read=timed(pipeline.load_wide, input_url)
+        frames, build=timed(pipeline.build_frames, df_lookup, wide, engine)
+        result[engine]={'load_s':read+build, 'build_s':build, 'rows':sum(len(frame) for frame in frames)}
+    result['speedup']=result['pandas']['load_s']/result['dense']['load_s']
+    return result
+
+# The JSON result of a benchmark.py expression evaluated in a fresh interpreter.
+def subprocess_json(expression):
+    code=f'import json, benchmark; print(json.dumps({expression}))'
+    out=subprocess.run([sys.executable, '-c', code], cwd=snapshot.ROOT, capture_output=True, text=True, check=True)
+    return json.loads(out.stdout.splitlines()[-1])
+
+# Run in a fresh interpreter by bench_areas: loads the snapshot the way a
+# worker does (counties=False reads the states lazily, True all of them up
+# front), serves every date of the World view and reports its memory.
+def cold_worker(path, counties):
+    import refresh
+    version=snapshot.current(path)
+    start=time.perf_counter()
+    frames=refresh.bundle(*snapshot.read(path, version, counties), version,
+                          snapshot.read_geo(path, version) if counties else None, path)
+    startup=time.perf_counter()-start
+    world=frames.areas.get('World')
+    _, serve=timed(lambda: [schema.rows(world.facts, world.dimension, a, b) for a, b in world.dates.values()]
+                   +[store.payload(world.timeline, 'confirmed')])
+    gc.collect()
+    result={'startup_s':startup, 'serve_world_s':serve}
+    result.update({f'{key}_mb':value/2**20 for key, value in memory_usage().items()})
+    _, result['first_state_s']=timed(frames.areas.get, '48')
+    return result
+
+# Startup time and memory of a cold worker that only serves the World view,
+# with the counties of every state loaded up front against read on demand.
+def bench_areas(input_url, counties_url, workdir):
+    path=os.path.join(workdir, 'snapshot')
+    snapshot.build(path, input_url, counties_url)
+    result=dict()
+    for name, counties in [('eager', True), ('lazy', False)]:
+        result[name]=subprocess_json(f'benchmark.cold_worker({path!r}, {counties})')
+    return result
+
+# Bytes per row of each frame as prepared from the snapshot against the
+# schema.compact facts plus their dimension table spread over the rows, and
+# the time the compaction adds to a load.
+def bench_schema(input_url, counties_url, workdir):
+    path=os.path.join(workdir, 'snapshot')
+    snapshot.build(path, input_url, counties_url)
+    df, df_states, df_us, df_geo=snapshot.read(path)
+    df, df_states, df_us, _, _, _=store.prepare(df, df_states, df_us)
+    result=dict()
+    for name, frame in [('df', df), ('df_states', df_states), ('df_us', df_us)]:
+        (facts, dimension), seconds=timed(schema.compact, frame, **schema.SCHEMA[name])
+        result[name]={'rows':len(frame), 'locations':len(dimension), 'bytes_per_row':schema.bytes_per_row(frame),
+                      'compact_bytes_per_row':schema.bytes_per_row(facts, dimension), 'compact_ms':seconds*1000}
+    return result
+
+# Serves a directory over HTTP/1.1 keep-alive, with an ETag per file version
+# (next to the Last-Modified of SimpleHTTPRequestHandler) and `latency`
+# seconds of delay per request, standing in for the upstream servers.
+class StandIn(http.server.SimpleHTTPRequestHandler):
+    protocol_version='HTTP/1.1'
+    latency=0
+
+    def do_GET(self):
+        time.sleep(self.latency)
+        self.etag=None
+        path=self.translate_path(self.path)
+        if os.path.isfile(path):
+            stat=os.stat(path)
+            self.etag=f'"{stat.st_mtime_ns:x}-{stat.st_size:x}"'
+            if self.headers.get('If-None-Match')==self.etag:
+                self.send_response(304)
+                self.end_headers()
+                return
+        super().do_GET()
+
+    def end_headers(self):
+        if self.etag:
+            self.send_header('ETag', self.etag)
+        super().end_headers()
+
+    def log_message(self, *args):
+        pass
+
+def stand_in(directory, latency):
+    handler=type('Handler', (StandIn,), {'latency':latency,
+                                        '__init__':lambda self, *args: StandIn.__init__(self, *args, directory=directory)})
+    server=http.server.ThreadingHTTPServer(('127.0.0.1', 0), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f'http://127.0.0.1:{server.server_port}/'
+
+# The upstream files served from the synthetic mirror with `latency` per
+# request: one urlopen after another (the old loader), then fetch.fetch into
+# an empty mirror, again with nothing changed, and after a day is appended.
+def bench_fetch(input_url, counties_url, workdir, latency=0.05):
+    directory=input_url[len('file://'):]
+    server, base=stand_in(directory, latency)
+    urls=pipeline.source_urls(base)+[base+os.path.basename(counties_url)]
+    mirror=os.path.join(workdir, 'fetched')
+    def serial():
+        for url in urls:
+            with urlopen(url) as response:
+                response.read()
+    def run(name):
+        files, seconds=timed(fetch.fetch, urls, mirror)
+        statuses=[fetched.status for fetched in files.values()]
+        result[name+'_s']=seconds
+        result[name+'_downloaded']=statuses.count('downloaded')
+        result[name+'_mb']=sum(fetched.bytes for fetched in files.values())/2**20
+    try:
+        result={'files':len(urls), 'latency_s':latency, 'serial_s':timed(serial)[1]}
+        run('cold')
+        run('warm')
+        append_day(directory)
+        run('changed')
+        _, result['load_all_warm_s']=timed(pipeline.load_all, base, urls[-1])
+    finally:
+        server.shutdown()
+    return result
+
+BENCHMARKS={'startup':bench_startup, 'memory':bench_memory, 'ingest':bench_ingest, 'df_date':bench_df_date, 'frames':bench_frames, 'df_location':bench_df_location, 'wire':bench_wire, 'scrub':bench_scrub, 'geo':bench_geo, 'schema':bench_schema, 'engine':bench_engine, 'areas':bench_areas, 'fetch':bench_fetch,
+            'transform':bench_transform, 'callbacks':bench_callbacks, 'load':bench_load, 'http':bench_http, 'api':bench_api}
+
+# Numeric results by dotted path, for comparing two runs.
+def leaves(result, prefix=''):
+    if isinstance(result, dict):
+        for key, value in result.items():
+            yield from leaves(value, f'{prefix}.{key}' if prefix else key)
+    elif isinstance(result, (int, float)) and not isinstance(result, bool):
+        yield prefix, result
+
+def compare(old, new, log=sys.stdout):
+    old=dict(leaves(old['results']))
+    for name, value in leaves(new['results']):
+        if name in old:
+            ratio=f'{value/old[name]:8.2f}x' if old[name] else ''
+            print(f'{name:60} {old[name]:14.4g} {value:14.4g} {ratio}', file=log)
+
+def describe(args):
+    try:
+        commit=subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=snapshot.ROOT, capture_output=True, text=True).stdout.strip()
+    except OSError:
+        commit=None
+    return {'args':vars(args), 'commit':commit, 'at':time.strftime('%Y-%m-%dT%H:%M:%S'), 'python':sys.version.split()[0],
+            'pandas':pd.__version__, 'numpy':np.__version__, 'cpus':os.cpu_count(),
+            'env':{name:os.environ[name] for name in ['ENGINE', 'WIRE_FORMAT', 'PREFETCH', 'CACHE_TYPE'] if name in os.environ}}
+
+if __name__ == '__main__':
+    parser=argparse.ArgumentParser()
+    parser.add_argument('benchmarks', nargs='*', default=list(BENCHMARKS))
+    parser.add_argument('--live', action='store_true', help='read the upstream JHU files instead of a synthetic mirror')
+    parser.add_argument('--countries', type=int, default=180)
+    parser.add_argument('--counties', type=int, default=3000)
+    parser.add_argument('--days', type=int, default=280)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help='write the results with the run\'s settings to this JSON file')
+    parser.add_argument('--compare', help='a previous --output file to print each result against')
+    args=parser.parse_args()
+    run={**describe(args), 'results':dict()}
+    with tempfile.TemporaryDirectory() as workdir:
+        if args.live:
+            input_url, counties_url=pipeline.INPUT_URL, pipeline.COUNTIES_URL
+        else:
+            input_url, counties_url=write_mirror(os.path.join(workdir, 'mirror'), args.countries, args.counties, args.days, args.seed)
+        for name in args.benchmarks:
+            run['results'][name]=BENCHMARKS[name](input_url, counties_url, workdir)
+            print(name, json.dumps(run['results'][name]))
+            sys.stdout.flush()
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(run, f, indent=1)
+    if args.compare:
+        with open(args.compare) as f:
+            compare(json.load(f), run)
@@ -0,0 +1,144 @@
+import os
+import sys
+import json
+import time
+import zlib
+import threading
+import http.client
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit, urljoin, unquote
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+MIRROR_DIR = os.environ.get('MIRROR_DIR', os.path.join(ROOT, 'mirror'))
+FETCH_WORKERS = int(os.environ.get('FETCH_WORKERS', '8'))
+TIMEOUT = 60
+REDIRECTS = 5
+
+# Local copies of the upstream files. An http(s) URL is kept at
+# MIRROR_DIR/<host>/<path>, with the ETag and Last-Modified it was served with
+# in a .meta file next to it. Fetching it again sends those back, and a 304
+# leaves the copy as it is. file:// URLs and plain paths are read in place.
+# All URLs are fetched at once on a pool of threads, each keeping one
+# persistent connection per host. `status` is 'downloaded', 'not modified',
+# 'local', or 'stale' when the server could not be reached and an earlier
+# copy is used instead.
+Fetched = namedtuple('Fetched', ['url', 'path', 'status', 'bytes', 'seconds'])
+
+def mirror_path(url, mirror=MIRROR_DIR):
+    parts=urlsplit(url)
+    return os.path.join(mirror, parts.netloc, unquote(parts.path).lstrip('/'))
+
+def read_meta(path):
+    try:
+        with open(path+'.meta') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return dict()
+
+# One thread's open connections, by scheme and host.
+class Connections:
+    def __init__(self):
+        self.open=dict()
+
+    def get(self, url, headers):
+        parts=urlsplit(url)
+        key=(parts.scheme, parts.netloc)
+        target=(parts.path or '/')+('?'+parts.query if parts.query else '')
+        for retry in (False, True):
+            if key not in self.open:
+                connection=http.client.HTTPSConnection if parts.scheme=='https' else http.client.HTTPConnection
+                self.open[key]=connection(parts.netloc, timeout=TIMEOUT)
+            try:
+                self.open[key].request('GET', target, headers=headers)
+                return self.open[key].getresponse()
+            except (http.client.HTTPException, OSError):
+                # the server may have closed an idle connection; reconnect once
+                self.open.pop(key).close()
+                if retry:
+                    raise
+
+    def close(self):
+        for connection in self.open.values():
+            connection.close()
+        self.open.clear()
+
+# Streams the body to a temporary file, so a failed download never replaces
+# the previous copy.
+def save(response, path):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    gzipped=response.getheader('Content-Encoding', '').lower()=='gzip'
+    inflate=zlib.decompressobj(16+zlib.MAX_WBITS)
+    size=0
+    with open(path+'.tmp', 'wb') as f:
+        while True:
+            chunk=response.read(2**16)
+            if not chunk:
+                break
+            size+=len(chunk)
+            f.write(inflate.decompress(chunk) if gzipped else chunk)
+        if gzipped:
+            f.write(inflate.flush())
+    os.replace(path+'.tmp', path)
+    with open(path+'.meta', 'w') as f:
+        json.dump({name:response.getheader(name) for name in ['ETag', 'Last-Modified'] if response.getheader(name)}, f)
+    return size
+
+def fetch_one(connections, url, mirror=MIRROR_DIR):
+    start=time.perf_counter()
+    parts=urlsplit(url)
+    if parts.scheme in ('', 'file'):
+        return Fetched(url, unquote(parts.path), 'local', 0, 0.0)
+    path=mirror_path(url, mirror)
+    headers={'Accept-Encoding':'gzip'}
+    if os.path.exists(path):
+        meta=read_meta(path)
+        if 'ETag' in meta:
+            headers['If-None-Match']=meta['ETag']
+        if 'Last-Modified' in meta:
+            headers['If-Modified-Since']=meta['Last-Modified']
+    try:
+        location=url
+        for _ in range(REDIRECTS):
+            response=connections.get(location, headers)
+            if response.status in (301, 302, 303, 307, 308):
+                response.read()
+                location=urljoin(location, response.getheader('Location'))
+                continue
+            if response.status==304:
+                response.read()
+                return Fetched(url, path, 'not modified', 0, time.perf_counter()-start)
+            if response.status!=200:
+                response.read()
+                raise OSError(f'HTTP {response.status} {response.reason}')
+            size=save(response, path)
+            return Fetched(url, path, 'downloaded', size, time.perf_counter()-start)
+        raise OSError('too many redirects')
+    except (http.client.HTTPException, OSError) as e:
+        if not os.path.exists(path):
+            raise OSError(f'{url}: {e}') from e
+        print(f'{url}: {e}, using the copy in {mirror}', file=sys.stderr)
+        return Fetched(url, path, 'stale', 0, time.perf_counter()-start)
+
+# Fetched by URL.
+def fetch(urls, mirror=MIRROR_DIR, workers=FETCH_WORKERS):
+    local=threading.local()
+    opened=[]
+    def run(url):
+        if not hasattr(local, 'connections'):
+            local.connections=Connections()
+            opened.append(local.connections)
+        return fetch_one(local.connections, url, mirror)
+    try:
+        with ThreadPoolExecutor(max(1, min(workers, len(urls)))) as pool:
+            return dict(zip(urls, pool.map(run, urls)))
+    finally:
+        for connections in opened:
+            connections.close()
+
+if __name__ == '__main__':
+    import pipeline
+    start=time.perf_counter()
+    for fetched in fetch(pipeline.source_urls()+[pipeline.COUNTIES_URL]).values():
+        print(f'{fetched.status:>12} {fetched.bytes:>10} {fetched.seconds:7.3f}s {fetched.url}')
+    print(f'{time.perf_counter()-start:.3f}s')
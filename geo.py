@@ -0,0 +1,113 @@
+import numpy as np
+
+# Simplified copies of the county shapes: (name, Douglas-Peucker tolerance in
+# degrees, decimals the coordinates are rounded to), finest first. 'full' is
+# the geometry as downloaded.
+LEVELS = [
+    ('high', 0.001, 4),
+    ('medium', 0.005, 3),
+    ('low', 0.02, 2),
+]
+# the choropleth is about this many pixels across when fitted to a state
+PIXELS = 1000
+
+def rings(geometry):
+    if geometry['type']=='Polygon':
+        return [geometry['coordinates']]
+    return geometry['coordinates']
+
+def douglas_peucker(points, tolerance):
+    keep=np.zeros(len(points), dtype=bool)
+    keep[[0, -1]]=True
+    stack=[(0, len(points)-1)]
+    while stack:
+        start, stop=stack.pop()
+        if stop-start<2:
+            continue
+        a, b=points[start], points[stop]
+        inner=points[start+1:stop]
+        ab=b-a
+        length=np.hypot(*ab)
+        if length:
+            distance=np.abs(ab[0]*(inner[:, 1]-a[1])-ab[1]*(inner[:, 0]-a[0]))/length
+        else:
+            distance=np.hypot(inner[:, 0]-a[0], inner[:, 1]-a[1])
+        i=int(np.argmax(distance))
+        if distance[i]>tolerance:
+            keep[start+1+i]=True
+            stack+=[(start, start+1+i), (start+1+i, stop)]
+    return keep
+
+# Like TopoJSON, rings are cut into arcs at the points where the set of rings
+# sharing a border changes, and every arc is simplified on its own, always in
+# the same direction. Neighbouring counties share the arc, so they get the
+# same simplified border and no gaps or overlaps open up between them. The
+# features keep only the id the choropleth matches on.
+def simplify(df_geo, tolerance, decimals):
+    shapes={(area, i):[[np.round(np.asarray(ring, dtype=float), decimals) for ring in polygon]
+                       for polygon in rings(feature['geometry'])]
+            for area, collection in df_geo.items() for i, feature in enumerate(collection['features'])}
+    members=dict()
+    for key, polygons in shapes.items():
+        for j, polygon in enumerate(polygons):
+            for k, ring in enumerate(polygon):
+                for point in map(tuple, ring[:-1]):
+                    members.setdefault(point, set()).add((key, j, k))
+    simplified={key:[[simplify_ring(ring, members, tolerance) for ring in polygon] for polygon in polygons]
+                for key, polygons in shapes.items()}
+    df_simple=dict()
+    for area, collection in df_geo.items():
+        features=[]
+        for i, feature in enumerate(collection['features']):
+            polygon=simplified[(area, i)]
+            geometry=({'type':'Polygon', 'coordinates':polygon[0]} if feature['geometry']['type']=='Polygon'
+                      else {'type':'MultiPolygon', 'coordinates':polygon})
+            features.append({'type':'Feature', 'id':feature['id'], 'geometry':geometry})
+        df_simple[area]=dict(collection, features=features)
+    return df_simple
+
+def simplify_ring(ring, members, tolerance):
+    points=ring[:-1]
+    if len(points)<4:
+        return ring.tolist()
+    shared=[members[tuple(point)] for point in points]
+    n=len(points)
+    cuts=[i for i in range(n) if len(shared[i])>2 or shared[i]!=shared[i-1] or shared[i]!=shared[(i+1)%n]]
+    if not cuts:
+        far=int(np.argmax(np.hypot(*(points-points[0]).T)))
+        cuts=sorted({0, far})
+    keep=np.zeros(n, dtype=bool)
+    keep[cuts]=True
+    for start, stop in zip(cuts, cuts[1:]+[cuts[0]+n]):
+        index=np.arange(start, stop+1)%n
+        arc=points[index]
+        if tuple(arc[0])>tuple(arc[-1]):
+            keep[index[::-1]]|=douglas_peucker(arc[::-1], tolerance)
+        else:
+            keep[index]|=douglas_peucker(arc, tolerance)
+    kept=points[keep]
+    kept=kept[np.r_[True, (np.diff(kept, axis=0)!=0).any(axis=1)]]
+    if len(kept)<3:
+        return ring.tolist()
+    return np.vstack([kept, kept[:1]]).tolist()
+
+def levels(df_geo):
+    return {name:simplify(df_geo, tolerance, decimals) for name, tolerance, decimals in LEVELS}
+
+# Degrees across each state's counties, the larger of its width and height.
+def spans(df_geo):
+    result=dict()
+    for area, collection in df_geo.items():
+        points=np.vstack([np.asarray(ring, dtype=float) for feature in collection['features']
+                          for polygon in rings(feature['geometry']) for ring in polygon])
+        result[area]=float((points.max(axis=0)-points.min(axis=0)).max())
+    return result
+
+# The coarsest level whose tolerance stays under a pixel of a map fitted to a
+# span of `span` degrees and zoomed in `zoom` times.
+def choose(span, zoom=1):
+    pixel=span/PIXELS/zoom
+    for name, tolerance, _ in reversed(LEVELS):
+        if tolerance<=pixel:
+            return name
+    return 'full'
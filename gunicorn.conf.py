@@ -0,0 +1,16 @@
+import gc
+import os
+
+# Import app.py once in the master so the frames, memory-mapped from the
+# snapshot, are shared by every worker instead of being rebuilt per worker.
+# Set PRELOAD=0 to get the old per-worker loading back.
+preload_app = os.environ.get('PRELOAD', '1') != '0'
+
+def pre_fork(server, worker):
+    # keep the collector from touching (and so copying) the master's objects
+    gc.freeze()
+
+def post_worker_init(worker):
+    # the refresher thread has to be started after the fork
+    import app
+    app.refresher.start()
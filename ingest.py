@@ -0,0 +1,71 @@
+import sys
+import pandas as pd
+import pipeline
+import snapshot
+import store
+
+GLOBAL = ['confirmed', 'deaths', 'recovered']
+US = ['confirmed_us', 'deaths_us']
+
+# Incremental update of the current snapshot: the new upstream files are
+# widened as usual and diffed cell by cell against the wide matrices stored
+# with the snapshot. Only new dates and revised cells are melted, combined and
+# spliced into the frames; anything else (a location or date disappearing, a
+# changed lookup table) falls back to a full rebuild. The derived series are
+# recomputed from the first patched date on.
+def changed_cells(new, old):
+    old=old.reindex(index=new.index, columns=new.columns)
+    return new.ne(old) & ~(new.isna() & old.isna())
+
+def union_mask(masks):
+    index, columns=masks[0].index, masks[0].columns
+    for mask in masks[1:]:
+        index, columns=index.union(mask.index), columns.union(mask.columns)
+    result=masks[0].reindex(index=index, columns=columns, fill_value=False)
+    for mask in masks[1:]:
+        result|=mask.reindex(index=index, columns=columns, fill_value=False)
+    return result
+
+def melt_changed(wide, mask, var_name):
+    mask=mask.reindex(index=wide.index, columns=wide.columns, fill_value=False)
+    rows, cols=mask.any(axis=1), mask.any(axis=0)
+    return pipeline.melt(wide.loc[rows, cols].where(mask.loc[rows, cols]), var_name)
+
+def splice(frame, patch, keys):
+    if patch.empty:
+        return frame
+    frame=pd.concat([frame, patch]).drop_duplicates(subset=keys, keep='last').reset_index(drop=True)
+    return store.derive(frame, keys[0], patch['date'].min())
+
+def appended_only(new, old):
+    return old.index.isin(new.index).all() and old.columns.isin(new.columns).all()
+
+def ingest(path=snapshot.SNAPSHOT_DIR, input_url=pipeline.INPUT_URL, counties_url=pipeline.COUNTIES_URL):
+    version=snapshot.current(path)
+    sources=snapshot.read_sources(path, version) if version else None
+    df_lookup, wide=pipeline.load_wide(input_url)
+    if (sources is None or sources[0]!=snapshot.lookup_hash(df_lookup)
+            or not all(appended_only(wide[name], sources[1][name]) for name in GLOBAL+US)):
+        df_geo=snapshot.read(path, version)[3] if version else pipeline.load_geo(counties_url)
+        return snapshot.write(*pipeline.build_frames(df_lookup, wide), df_geo, path=path, sources=(df_lookup, wide)), None
+    old=sources[1]
+    mask=union_mask([changed_cells(wide[name], old[name]) for name in GLOBAL])
+    mask_us=union_mask([changed_cells(wide[name], old[name]) for name in US])
+    if not mask.values.any() and not mask_us.values.any():
+        return version, 0
+
+    df, df_states, df_us, df_geo=snapshot.read(path, version)
+    patch=pipeline.combine(*[melt_changed(wide[name], mask, name) for name in GLOBAL])
+    patch_us=pipeline.combine_us(*[melt_changed(wide[name], mask_us, name[:-3]) for name in US], df_lookup)
+    df=splice(df, patch, ['iso3', 'date'])
+    df_us=splice(df_us, patch_us, ['FIPS', 'date'])
+    # re-summing a few extra (state, date) pairs is cheaper than matching exact pairs
+    touched=df_us['Province_State'].isin(patch_us['Province_State'].unique()) & df_us['date'].isin(patch_us['date'].unique())
+    patch_states=pipeline.rollup_states(df_us[touched])
+    df_states=splice(df_states, patch_states, ['Province_State', 'date'])
+    rows=len(patch)+len(patch_us)+len(patch_states)
+    return snapshot.write(df, df_states, df_us, df_geo, path=path, sources=(df_lookup, wide)), rows
+
+if __name__ == '__main__':
+    version, rows=ingest(sys.argv[1] if len(sys.argv)>1 else snapshot.SNAPSHOT_DIR)
+    print(version, 'full rebuild' if rows is None else f'{rows} rows patched')
@@ -0,0 +1,167 @@
+import gzip
+import json
+import time
+import random
+import argparse
+import threading
+import http.client
+from collections import defaultdict
+from urllib.parse import urlsplit
+import numpy as np
+
+# Visitors driving /_dash-update-component the way a browser does with this
+# layout. The server-side callbacks and their inputs are read from
+# /_dash-dependencies, the areas, metrics and slider ticks from /_dash-layout,
+# so the same traffic runs against any PREFETCH or WIRE_FORMAT setting. A
+# visitor opens the page (every server callback once), then repeatedly picks
+# an area, scrubs the slider over a run of dates, now and then switches the
+# metric or zooms the map. Hovering the map is answered in the browser from
+# the 'location' store and sends nothing.
+SCRUB = (10, 60)
+METRIC_CHANCE = 0.2
+ZOOM_CHANCE = 0.1
+
+def components(layout):
+    if isinstance(layout, dict):
+        props=layout.get('props', {})
+        if 'id' in props:
+            yield props
+        yield from components(props.get('children'))
+    elif isinstance(layout, list):
+        for child in layout:
+            yield from components(child)
+
+class Visitor:
+    def __init__(self, url, rng, think=0.0):
+        parts=urlsplit(url)
+        self.prefix=parts.path.rstrip('/')
+        self.connection=http.client.HTTPConnection(parts.netloc, timeout=60)
+        self.rng=rng
+        self.think=think
+        self.latencies=defaultdict(list)
+        self.bytes=defaultdict(int)
+        self.errors=defaultdict(int)
+
+    def get(self, path):
+        self.connection.request('GET', self.prefix+path)
+        response=self.connection.getresponse()
+        return json.loads(response.read())
+
+    def open(self):
+        dependencies=self.get('/_dash-dependencies')
+        self.callbacks=[dependency for dependency in dependencies if not dependency.get('clientside_function')
+                        and not dependency['output'].startswith('..')]
+        props={item['id']:item for item in components(self.get('/_dash-layout'))}
+        self.areas=[option['value'] for option in props['select-area']['options']]
+        self.metrics=[option['value'] for option in props['select-data']['options']]
+        self.ticks=sorted(int(tick) for tick in props['date-slider']['marks'])
+        self.state={(key, prop):value for key, item in props.items() for prop, value in item.items()}
+        self.fire(None)
+
+    def post(self, callback, changed):
+        output=callback['output']
+        key, prop=output.rsplit('.', 1)
+        body=json.dumps({'output':output, 'outputs':{'id':key, 'property':prop},
+                         'inputs':[dict(item, value=self.state.get((item['id'], item['property']))) for item in callback['inputs']],
+                         'state':[dict(item, value=self.state.get((item['id'], item['property']))) for item in callback['state']],
+                         'changedPropIds':changed})
+        start=time.perf_counter()
+        try:
+            self.connection.request('POST', self.prefix+'/_dash-update-component', body,
+                                    {'Content-Type':'application/json', 'Accept-Encoding':'gzip'})
+            response=self.connection.getresponse()
+            data=response.read()
+        except (http.client.HTTPException, OSError):
+            self.connection.close()
+            self.errors[output]+=1
+            return
+        self.latencies[output].append(time.perf_counter()-start)
+        self.bytes[output]+=len(data)
+        if response.status==200:
+            if response.getheader('Content-Encoding')=='gzip':
+                data=gzip.decompress(data)
+            self.state[(key, prop)]=json.loads(data)['response'][key][prop]
+        elif response.status!=204:
+            self.errors[output]+=1
+
+    # Sets a property (None: the page load) and calls every server callback
+    # taking it as an input.
+    def fire(self, key, value=None):
+        if key is not None:
+            self.state[key]=value
+        changed=[] if key is None else [f'{key[0]}.{key[1]}']
+        for callback in self.callbacks:
+            if key is None or any((item['id'], item['property'])==key for item in callback['inputs']):
+                self.post(callback, changed)
+        if self.think:
+            time.sleep(self.think)
+
+    def visit(self):
+        self.fire(('select-area', 'value'), self.rng.choice(self.areas))
+        if self.rng.random()<METRIC_CHANCE:
+            self.fire(('select-data', 'value'), self.rng.choice(self.metrics))
+        if self.rng.random()<ZOOM_CHANCE:
+            self.fire(('zoom', 'data'), self.rng.choice([2, 4, 8]))
+        length=min(len(self.ticks), self.rng.randint(*SCRUB))
+        first=self.rng.randrange(len(self.ticks)-length+1)
+        for tick in self.ticks[first:first+length]:
+            self.fire(('date-slider', 'value'), tick)
+
+def percentiles(values):
+    values=np.array(values)*1000
+    return {'mean_ms':values.mean(), 'p50_ms':np.percentile(values, 50),
+            'p90_ms':np.percentile(values, 90), 'p99_ms':np.percentile(values, 99)}
+
+# Runs `visitors` concurrent visitors for `duration` seconds and reports
+# requests, bytes and latency per callback output and overall.
+def run(url, visitors=8, duration=10.0, think=0.0, seed=0):
+    results=[]
+    def session(index):
+        visitor=Visitor(url, random.Random(seed+index), think)
+        try:
+            visitor.open()
+            while time.perf_counter()<deadline:
+                visitor.visit()
+        finally:
+            visitor.connection.close()
+            results.append(visitor)
+    deadline=time.perf_counter()+duration
+    start=time.perf_counter()
+    threads=[threading.Thread(target=session, args=(i,)) for i in range(visitors)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed=time.perf_counter()-start
+    latencies, sizes, errors=defaultdict(list), defaultdict(int), defaultdict(int)
+    for visitor in results:
+        for output, values in visitor.latencies.items():
+            latencies[output]+=values
+            sizes[output]+=visitor.bytes[output]
+        for output, count in visitor.errors.items():
+            errors[output]+=count
+    requests=sum(len(values) for values in latencies.values())
+    report={'visitors':visitors, 'seconds':elapsed, 'requests':requests, 'requests_per_s':requests/elapsed,
+            'errors':sum(errors.values()), 'callbacks':dict()}
+    if requests:
+        report.update(percentiles([value for values in latencies.values() for value in values]))
+    for output, values in sorted(latencies.items()):
+        report['callbacks'][output]={'requests':len(values), 'bytes_per_request':sizes[output]/len(values),
+                                     'errors':errors[output], **percentiles(values)}
+    return report
+
+if __name__ == '__main__':
+    parser=argparse.ArgumentParser()
+    parser.add_argument('url', nargs='?', default='http://127.0.0.1:8050')
+    parser.add_argument('--visitors', type=int, default=8)
+    parser.add_argument('--duration', type=float, default=30)
+    parser.add_argument('--think', type=float, default=0.05, help='seconds between a visitor\'s actions')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help='write the report to this JSON file')
+    args=parser.parse_args()
+    report=run(args.url, args.visitors, args.duration, args.think, args.seed)
+    text=json.dumps(report, indent=1)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text)
+    print(text)
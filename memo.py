@@ -0,0 +1,68 @@
+import os
+import functools
+import threading
+from collections import Counter
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+TIMEOUT = 86400
+# 'simple' keeps a cache per process; 'filesystem' and 'redis' share one
+# between the gunicorn workers.
+CACHE_TYPE = os.environ.get('CACHE_TYPE', 'simple')
+# Entries kept by the simple and filesystem backends before the oldest are
+# evicted. Redis evicts by its own maxmemory policy.
+CACHE_THRESHOLD = int(os.environ.get('CACHE_THRESHOLD', '500'))
+
+def cache_config(cache_type=CACHE_TYPE, threshold=CACHE_THRESHOLD):
+    config={
+        'CACHE_TYPE':cache_type,
+        'CACHE_DEFAULT_TIMEOUT':TIMEOUT,
+        'CACHE_THRESHOLD':threshold,
+        'CACHE_KEY_PREFIX':'coronavirus:',
+    }
+    if cache_type=='redis':
+        config['CACHE_REDIS_URL']=os.environ.get('REDIS_URL', 'redis://localhost:6379')
+    elif cache_type=='filesystem':
+        config['CACHE_DIR']=os.environ.get('CACHE_DIR', os.path.join(ROOT, 'cache'))
+    return config
+
+# Per-process hit and miss counts of the memoized callbacks.
+class Stats:
+    def __init__(self):
+        self.lock=threading.Lock()
+        self.calls=Counter()
+        self.misses=Counter()
+
+    def count(self, counter, name):
+        with self.lock:
+            counter[name]+=1
+
+    def report(self):
+        with self.lock:
+            return {name:{'hits':calls-self.misses[name], 'misses':self.misses[name]} for name, calls in self.calls.items()}
+
+stats = Stats()
+# Whether the last memoized call on this thread computed its result.
+local = threading.local()
+
+def missed():
+    return getattr(local, 'missed', False)
+
+# cache.memoize with the data version in every key: a worker that has not
+# picked up a new snapshot yet keeps reading and writing the entries of its own
+# version in a shared backend, so nothing has to be deleted on a refresh and
+# stale results are never served for new data.
+def memoize(cache, version):
+    def decorator(f):
+        @functools.wraps(f)
+        def compute(*args, **kwargs):
+            stats.count(stats.misses, f.__name__)
+            local.missed=True
+            return f(*args, **kwargs)
+        memoized=cache.memoize(make_name=lambda name: f'{name}@{version()}')(compute)
+        @functools.wraps(memoized)
+        def call(*args, **kwargs):
+            stats.count(stats.calls, f.__name__)
+            local.missed=False
+            return memoized(*args, **kwargs)
+        return call
+    return decorator
@@ -0,0 +1,152 @@
+import os
+import sys
+import time
+import random
+import cProfile
+import functools
+import inspect
+import threading
+from bisect import bisect_left
+import flask
+import memo
+import store
+import warmup
+
+# cProfile dumps of slow callbacks go here; unset, nothing is profiled.
+PROFILE_DIR = os.environ.get('PROFILE_DIR', '')
+# Share of callback requests run under the profiler, and the time (callback
+# plus encoding its response) above which such a request's profile is kept.
+PROFILE_SAMPLE = float(os.environ.get('PROFILE_SAMPLE', '0.1'))
+PROFILE_SLOW_MS = float(os.environ.get('PROFILE_SLOW_MS', '250'))
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+SECONDS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5)
+BYTES = (1000, 10000, 100000, 1000000, 10000000)
+LABELS = ('callback', 'area', 'metric')
+AREAS = set(warmup.AREAS)
+SERIES = {series for metric in store.METRICS for series in store.series(metric)}
+
+# Label values are only taken from the known areas and series, anything else
+# a client sends is counted as 'other'.
+def labels(name, arguments):
+    area, data=arguments.get('area'), arguments.get('data')
+    return (name, area if area in AREAS else 'other', '' if 'data' not in arguments else data if data in SERIES else 'other')
+
+# Per-process histograms (non-cumulative bucket counts, then the sum) and
+# counters by label values, rendered in the Prometheus text format.
+class Registry:
+    def __init__(self):
+        self.lock=threading.Lock()
+        self.histograms={'seconds':dict(), 'serialize_seconds':dict(), 'response_bytes':dict()}
+        self.cache=dict()
+        self.profiles=0
+
+    def observe(self, name, labels, value):
+        buckets=BYTES if name=='response_bytes' else SECONDS
+        with self.lock:
+            counts=self.histograms[name].setdefault(labels, [0]*(len(buckets)+1)+[0])
+            counts[bisect_left(buckets, value)]+=1
+            counts[-1]+=value
+
+    def count(self, labels, result):
+        with self.lock:
+            self.cache[labels+(result,)]=self.cache.get(labels+(result,), 0)+1
+
+    def render(self):
+        lines=[]
+        def label_text(values, names=LABELS):
+            return ','.join(f'{name}="{value}"' for name, value in zip(names, values))
+        with self.lock:
+            for name, doc in [('seconds', 'Time spent in the callback.'),
+                              ('serialize_seconds', 'Time from the callback returning to its response being encoded.'),
+                              ('response_bytes', 'Size of the encoded response.')]:
+                metric=f'coronavirus_callback_{name}'
+                buckets=BYTES if name=='response_bytes' else SECONDS
+                lines+=[f'# HELP {metric} {doc}', f'# TYPE {metric} histogram']
+                for values, counts in sorted(self.histograms[name].items()):
+                    total=0
+                    for le, count in zip([*buckets, '+Inf'], counts):
+                        total+=count
+                        lines.append(f'{metric}_bucket{{{label_text(values)},le="{le}"}} {total}')
+                    lines.append(f'{metric}_sum{{{label_text(values)}}} {counts[-1]}')
+                    lines.append(f'{metric}_count{{{label_text(values)}}} {total}')
+            lines+=['# HELP coronavirus_callback_cache_total Memoized callback requests by cache result: hit, miss, '
+                    'or http when the encoded response was served without calling the callback.',
+                    '# TYPE coronavirus_callback_cache_total counter']
+            for values, count in sorted(self.cache.items()):
+                lines.append(f'coronavirus_callback_cache_total{{{label_text(values, LABELS+("result",))}}} {count}')
+            lines+=['# HELP coronavirus_profiles_total Slow callback profiles written to PROFILE_DIR.',
+                    '# TYPE coronavirus_profiles_total counter', f'coronavirus_profiles_total {self.profiles}']
+        return '\n'.join(lines)+'\n'
+
+registry = Registry()
+# cProfile can only follow one request at a time.
+profiling = threading.Lock()
+
+def profile():
+    if not PROFILE_DIR or random.random()>=PROFILE_SAMPLE or not profiling.acquire(blocking=False):
+        return None
+    profiler=cProfile.Profile()
+    profiler.enable()
+    return profiler
+
+# Times a server-side callback inside a request and leaves its labels and
+# timings on flask.g for after_request, which adds the encoding time and the
+# response size once Dash has built the response. Calls outside a request
+# (the warm-up) are not recorded.
+def instrument(f):
+    parameters=list(inspect.signature(f).parameters)
+    memoized=hasattr(f, 'uncached')
+    @functools.wraps(f)
+    def call(*args, **kwargs):
+        if not flask.has_request_context():
+            return f(*args, **kwargs)
+        flask.g.profiler=profile()
+        start=time.perf_counter()
+        result=f(*args, **kwargs)
+        end=time.perf_counter()
+        flask.g.callback=(labels(f.__name__, dict(zip(parameters, args), **kwargs)), end-start, end,
+                          memo.missed() if memoized else None)
+        return result
+    return call
+
+def after_request(response):
+    if 'callback' not in flask.g or response.status_code!=200:
+        return response
+    labels, seconds, end, missed=flask.g.callback
+    serialize=time.perf_counter()-end
+    registry.observe('seconds', labels, seconds)
+    registry.observe('serialize_seconds', labels, serialize)
+    registry.observe('response_bytes', labels, response.calculate_content_length() or 0)
+    if missed is not None:
+        registry.count(labels, 'miss' if missed else 'hit')
+    flask.g.slow=(seconds+serialize)*1000>=PROFILE_SLOW_MS
+    return response
+
+# Labels of the callback the current request called, or None.
+def request_labels():
+    return flask.g.callback[0] if 'callback' in flask.g else None
+
+# A callback request answered with a stored response (responses.Callbacks),
+# which never reaches the callback.
+def served(labels):
+    registry.count(labels, 'http')
+
+# Stops a sampled profile, even when the callback raised, and writes it out
+# if the request was slow.
+def teardown_request(exception=None):
+    profiler=flask.g.pop('profiler', None)
+    if profiler is None:
+        return
+    try:
+        profiler.disable()
+        if flask.g.get('slow'):
+            name='-'.join(flask.g.callback[0])
+            os.makedirs(PROFILE_DIR, exist_ok=True)
+            profiler.dump_stats(os.path.join(PROFILE_DIR, f'{name}-{int(time.time()*1000)}-{os.getpid()}.prof'))
+            with registry.lock:
+                registry.profiles+=1
+    except OSError as e:
+        print(f'could not write profile ({e})', file=sys.stderr)
+    finally:
+        profiling.release()
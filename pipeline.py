@@ -0,0 +1,274 @@
+import os
+import json
+from collections import namedtuple
+import numpy as np
+import pandas as pd
+import store
+import fetch
+
+INPUT_URL = os.environ.get('INPUT_URL', "https://raw.githubusercontent.com/CSSEGISandData/COVID-19/master/csse_covid_19_data/")
+COUNTIES_URL = os.environ.get('COUNTIES_URL', 'https://raw.githubusercontent.com/plotly/datasets/master/geojson-counties-fips.json')
+# 'dense' works on the wide matrices and only builds the long frames at the
+# end; 'pandas' melts, merges and groups the long frames. Both give the same
+# frames.
+ENGINE = os.environ.get('ENGINE', 'dense')
+
+abbreviations={
+    "Alabama": ["01", "AL"],
+    "Alaska": ["02", "AK"],
+    "Arizona": ["04", "AZ"],
+    "Arkansas": ["05", "AR"],
+    "California": ["06", "CA"],
+    "Colorado": ["08", "CO"],
+    "Connecticut": ["09", "CT"],
+    "Delaware": ["10", "DE"],
+    "District of Columbia": ["11", "DC"],
+    "Florida": ["12", "FL"],
+    "Georgia": ["13", "GA"],
+    "Hawaii": ["15", "HI"],
+    "Idaho": ["16", "ID"],
+    "Illinois": ["17", "IL"],
+    "Indiana": ["18", "IN"],
+    "Iowa": ["19", "IA"],
+    "Kansas": ["20", "KS"],
+    "Kentucky": ["21", "KY"],
+    "Louisiana": ["22", "LA"],
+    "Maine": ["23", "ME"],
+    "Maryland": ["24", "MD"],
+    "Massachusetts": ["25", "MA"],
+    "Michigan": ["26", "MI"],
+    "Minnesota": ["27", "MN"],
+    "Mississippi": ["28", "MS"],
+    "Missouri": ["29", "MO"],
+    "Montana": ["30", "MT"],
+    "Nebraska": ["31", "NE"],
+    "Nevada": ["32", "NV"],
+    "New Hampshire": ["33", "NH"],
+    "New Jersey": ["34", "NJ"],
+    "New Mexico": ["35", "NM"],
+    "New York": ["36", "NY"],
+    "North Carolina": ["37", "NC"],
+    "North Dakota": ["38", "ND"],
+    "Ohio": ["39", "OH"],
+    "Oklahoma": ["40", "OK"],
+    "Oregon": ["41", "OR"],
+    "Pennsylvania": ["42", "PA"],
+    "Rhode Island": ["44", "RI"],
+    "South Carolina": ["45", "SC"],
+    "South Dakota": ["46", "SD"],
+    "Tennessee": ["47", "TN"],
+    "Texas": ["48", "TX"],
+    "Utah": ["49", "UT"],
+    "Vermont": ["50", "VT"],
+    "Virginia": ["51", "VA"],
+    "Washington": ["53", "WA"],
+    "West Virginia": ["54", "WV"],
+    "Wisconsin": ["55", "WI"],
+    "Wyoming": ["56", "WY"],
+    "American Samoa": ["60", "AS"],
+    "Guam": ["66", "GU"],
+    "Northern Mariana Islands": ["69", "MP"],
+    "Puerto Rico": ["72", "PR"],
+    "Virgin Islands": ["78", "VI"]
+}
+
+SOURCES = {
+    'confirmed': 'csse_covid_19_time_series/time_series_covid19_confirmed_global.csv',
+    'deaths': 'csse_covid_19_time_series/time_series_covid19_deaths_global.csv',
+    'recovered': 'csse_covid_19_time_series/time_series_covid19_recovered_global.csv',
+    'confirmed_us': 'csse_covid_19_time_series/time_series_covid19_confirmed_US.csv',
+    'deaths_us': 'csse_covid_19_time_series/time_series_covid19_deaths_US.csv',
+}
+LOOKUP = 'UID_ISO_FIPS_LookUp_Table.csv'
+
+# The JHU files are aggregated while still wide (one column per date) and
+# only then melted to long form, so the wide stage can also be diffed by ingest.py.
+def widen(df, df_lookup):
+    df = df.drop(columns=['Lat', 'Long']).merge(
+        df_lookup.rename(columns={'Country_Region': 'Country/Region', 'Province_State': 'Province/State'})[['Country/Region', 'Province/State', 'iso3','Population']],
+        how='outer',
+        on=['Country/Region', 'Province/State']
+    ).dropna(subset=["iso3"])
+    return df.groupby(['iso3','Country/Region']).sum().set_index('Population', append=True)
+
+def widen_us(df, var_name):
+    if var_name == 'deaths':
+        df=df.drop(columns=['Population'])
+    return df.drop(columns=['UID','iso2','iso3','Country_Region','code3']).groupby(['FIPS','Admin2','Province_State','Lat','Long_']).sum()
+
+def melt(wide, var_name):
+    df = wide.reset_index().melt(id_vars=list(wide.index.names), 
+        value_vars=list(wide.columns), 
+        var_name='date', 
+        value_name=var_name
+    ).dropna()
+    df['date']=pd.to_datetime(df['date'])
+    return df
+
+def transform_and_standardize(df, var_name, df_lookup):
+    return melt(widen(df, df_lookup), var_name).sort_values(by=['iso3', 'date'])
+
+def transform_and_standardize_us(df, var_name):
+    return melt(widen_us(df, var_name), var_name).sort_values(by=['FIPS', 'date'])
+
+def combine(df_confirmed, df_deaths, df_recovered):
+    df = df_confirmed.merge(df_deaths,how='outer',on=['date', 'iso3', 'Population','Country/Region']).merge(df_recovered,how='outer',on=['date', 'iso3', 'Population','Country/Region'])
+    for col in ['confirmed', 'deaths', 'recovered']:
+        df[f'{col}_rate'] = (df[col]/df['Population']*1000000000).astype('int64')
+    return df
+
+def combine_us(df_confirmed_us, df_deaths_us, df_lookup):
+    df_us=df_confirmed_us.merge(df_deaths_us.drop(columns=['Lat','Long_']),how='outer',on=['date', 'FIPS', 'Admin2','Province_State'])
+    df_us=df_us.merge(df_lookup[['FIPS','Population']],
+                      how='outer',
+                      on=['FIPS']).dropna()
+    df_us = df_us.astype({'FIPS':'int','confirmed':'int','deaths':'int','Population':'int'})
+    for col in ['confirmed', 'deaths']:
+        df_us[f'{col}_rate'] = (df_us[col]/df_us['Population']*1000000000).astype('int64')
+    df_us['number']=df_us['Province_State'].map(lambda x: abbreviations[x][0])
+    df_us['FIPS']=df_us['FIPS'].astype(str).str.zfill(5)
+    return df_us
+
+def rollup_states(df_us):
+    df_states=df_us.groupby(['Province_State','date'], observed=True)[['Lat','Long_','confirmed','deaths','Population']].sum().reset_index()
+    for col in ['confirmed', 'deaths']:
+        df_states[f'{col}_rate'] = (df_states[col]/df_states['Population']*1000000000).astype('int64')
+    df_states['number']=df_states['Province_State'].map(lambda x: abbreviations[x][0])
+    df_states['abbreviation']=df_states['Province_State'].map(lambda x: abbreviations[x][1])
+    return df_states
+
+def source_urls(input_url=INPUT_URL):
+    return [input_url+LOOKUP]+[input_url+source for source in SOURCES.values()]
+
+# `files` are fetch.fetch results covering the sources; without them the
+# sources are fetched here.
+def load_wide(input_url=INPUT_URL, files=None):
+    files = files or fetch.fetch(source_urls(input_url))
+    df_lookup = pd.read_csv(files[input_url+LOOKUP].path)
+    wide = dict()
+    for name, source in SOURCES.items():
+        if name.endswith('_us'):
+            wide[name] = widen_us(pd.read_csv(files[input_url+source].path), name[:-3])
+        else:
+            wide[name] = widen(pd.read_csv(files[input_url+source].path), df_lookup)
+    return df_lookup, wide
+
+# The dense engine: every source as a locations x dates matrix, aligned on a
+# shared location index and date axis instead of merged on long rows.
+# `index` is a frame of the location attributes, one row per matrix row.
+Matrix = namedtuple('Matrix', ['index', 'dates', 'values'])
+
+def rates(values, population):
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return (values/population*1000000000).astype('int64')
+
+# Like the outer merges in combine: a location or date missing from a source
+# is NaN there.
+def matrix(wide):
+    names=['confirmed', 'deaths', 'recovered']
+    index, columns=wide[names[0]].index, wide[names[0]].columns
+    for name in names[1:]:
+        index, columns=index.union(wide[name].index, sort=False), columns.union(wide[name].columns, sort=False)
+    values={name:wide[name].reindex(index=index, columns=columns).to_numpy(dtype=float) for name in names}
+    population=index.get_level_values('Population').to_numpy()
+    for name in names:
+        values[f'{name}_rate']=rates(values[name], population[:, None])
+    return Matrix(index.to_frame(index=False), pd.to_datetime(columns), values)
+
+# Like combine_us: counties need both sources, a population in the lookup
+# table and the date in both files, so the matrix has no holes.
+def matrix_us(wide, df_lookup):
+    confirmed, deaths=wide['confirmed_us'], wide['deaths_us']
+    keys=['FIPS', 'Admin2', 'Province_State']
+    deaths=deaths.set_axis(deaths.index.droplevel(['Lat', 'Long_']))
+    population=df_lookup[['FIPS', 'Population']].dropna().drop_duplicates('FIPS').set_index('FIPS')['Population']
+    index=confirmed.index.to_frame(index=False)
+    index['Population']=index['FIPS'].map(population)
+    rows=(pd.MultiIndex.from_frame(index[keys]).isin(deaths.index) & index['Population'].notna()).to_numpy()
+    columns=confirmed.columns.intersection(deaths.columns, sort=False)
+    index=index[rows].reset_index(drop=True)
+    values={'confirmed':confirmed.loc[rows, columns].to_numpy(dtype='int64'),
+            'deaths':deaths.reindex(index=pd.MultiIndex.from_frame(index[keys]), columns=columns).to_numpy(dtype='int64')}
+    index=index.astype({'FIPS':'int', 'Population':'int'})
+    population=index['Population'].to_numpy()
+    for name in ['confirmed', 'deaths']:
+        values[f'{name}_rate']=rates(values[name], population[:, None])
+    index['number']=index['Province_State'].map(lambda x: abbreviations[x][0])
+    index['FIPS']=index['FIPS'].astype(str).str.zfill(5)
+    return Matrix(index, pd.to_datetime(columns), values)
+
+# The state rows as a segment sum over each state's counties.
+def rollup_matrix(matrix):
+    order=np.argsort(matrix.index['Province_State'].to_numpy(), kind='stable')
+    counties=matrix.index.iloc[order]
+    names=counties['Province_State'].to_numpy()
+    starts=np.flatnonzero(np.r_[True, names[1:]!=names[:-1]]) if len(names) else np.array([], dtype=int)
+    index=counties.groupby('Province_State', sort=True)[['Lat', 'Long_', 'Population']].sum().reset_index()
+    values={name:np.add.reduceat(matrix.values[name][order], starts, axis=0) if len(starts)
+            else matrix.values[name][:0] for name in ['confirmed', 'deaths']}
+    population=index['Population'].to_numpy()
+    for name in ['confirmed', 'deaths']:
+        values[f'{name}_rate']=rates(values[name], population[:, None])
+    index['number']=index['Province_State'].map(lambda x: abbreviations[x][0])
+    index['abbreviation']=index['Province_State'].map(lambda x: abbreviations[x][1])
+    return Matrix(index, matrix.dates, values)
+
+# The long frame of a matrix, a row per location and date with any value,
+# columns in the order `columns` (attributes, 'date' and values).
+def long(matrix, columns):
+    present=np.zeros((len(matrix.index), len(matrix.dates)), dtype=bool)
+    for values in matrix.values.values():
+        present|=~np.isnan(values) if values.dtype.kind=='f' else True
+    rows, days=np.nonzero(present)
+    frame=dict()
+    for col in columns:
+        if col=='date':
+            frame[col]=matrix.dates.to_numpy()[days]
+        elif col in matrix.values:
+            frame[col]=matrix.values[col][rows, days]
+        else:
+            frame[col]=matrix.index[col].to_numpy()[rows]
+    return pd.DataFrame(frame)
+
+def build_frames_dense(df_lookup, wide):
+    world, us=matrix(wide), matrix_us(wide, df_lookup)
+    df=long(world, ['iso3', 'Country/Region', 'Population', 'date', 'confirmed', 'deaths', 'recovered',
+                    'confirmed_rate', 'deaths_rate', 'recovered_rate'])
+    df_states=long(rollup_matrix(us), ['Province_State', 'date', 'Lat', 'Long_', 'confirmed', 'deaths', 'Population',
+                                       'confirmed_rate', 'deaths_rate', 'number', 'abbreviation'])
+    df_us=long(us, ['FIPS', 'Admin2', 'Province_State', 'Lat', 'Long_', 'date', 'confirmed', 'deaths', 'Population',
+                    'confirmed_rate', 'deaths_rate', 'number'])
+    return df, df_states, df_us
+
+def build_frames_pandas(df_lookup, wide):
+    df = combine(*[melt(wide[name], name).sort_values(by=['iso3', 'date']) for name in ['confirmed', 'deaths', 'recovered']])
+    df_us = combine_us(*[melt(wide[name], name[:-3]).sort_values(by=['FIPS', 'date']) for name in ['confirmed_us', 'deaths_us']], df_lookup)
+    return df, rollup_states(df_us), df_us
+
+# The frames with their derived series (store.derive).
+def build_frames(df_lookup, wide, engine=None):
+    frames=(build_frames_dense if (engine or ENGINE)=='dense' else build_frames_pandas)(df_lookup, wide)
+    return tuple(store.derive(frame, key) for frame, key in zip(frames, ['iso3', 'Province_State', 'FIPS']))
+
+def load_frames(input_url=INPUT_URL):
+    return build_frames(*load_wide(input_url))
+
+def split_counties(counties):
+    df_geo=dict()
+    for county in counties['features']:
+        area=county['properties']['STATE']
+        df_geo.setdefault(area,{'type':'FeatureCollection', 'features':[]})
+        df_geo[area]['features'].append(county)
+    return df_geo
+
+def load_geo(counties_url=COUNTIES_URL, files=None):
+    files = files or fetch.fetch([counties_url])
+    with open(files[counties_url].path) as f:
+        counties = json.load(f)
+    return split_counties(counties)
+
+# The time series and the county shapes, all fetched at once.
+def load_all(input_url=INPUT_URL, counties_url=COUNTIES_URL):
+    files = fetch.fetch(source_urls(input_url)+[counties_url])
+    df_lookup, wide = load_wide(input_url, files)
+    return df_lookup, wide, load_geo(counties_url, files)
@@ -0,0 +1,258 @@
+import os
+import sys
+import time
+import fcntl
+import threading
+import json
+import traceback
+from collections import namedtuple, OrderedDict, Counter
+import snapshot
+import store
+import ingest
+import geo
+
+REFRESH_INTERVAL = int(os.environ.get('REFRESH_INTERVAL', '0'))
+
+# Memory the state areas may take per process before the least recently used
+# are dropped.
+AREA_CACHE = int(os.environ.get('AREA_CACHE_MB', '256'))*2**20
+
+Frames = namedtuple('Frames', ['df', 'df_states', 'version', 'areas', 'spans', 'consistency'])
+
+# Array bytes of an area plus the JSON size of its shapes.
+def area_bytes(area, shapes):
+    arrays=[area.facts, area.dimension]
+    return int(sum(frame.memory_usage(deep=True, index=False).sum() for frame in arrays)
+               +sum(values.nbytes for values in area.timeline.values.values())+area.locations.codes.nbytes
+               +shapes['bytes'])
+
+# store.Area by area name. 'World' and 'USA' are built with the bundle; a
+# state's counties and shapes are only read (through `counties` and `shapes`,
+# both taking the state number) when the state is first asked for, and kept
+# in an LRU of at most `budget` bytes. A state with counties but no shapes
+# (the territories of map.geojson) is served with empty shape levels. Names
+# that are not a state number of the USA area are None without a disk read.
+# Thread-safe; two threads missing the same state may both build it.
+class Areas:
+    def __init__(self, areas, counties, shapes, totals, budget=AREA_CACHE):
+        self.areas=areas
+        self.counties=counties
+        self.shapes=shapes
+        self.totals=totals
+        self.budget=budget
+        self.lock=threading.Lock()
+        self.cache=OrderedDict()
+        self.size=0
+        self.counts=Counter()
+        self.sizes=dict()
+        usa=areas.get('USA')
+        self.states=set(usa.dimension['number'].astype(str)) if usa is not None and 'number' in usa.dimension else set()
+
+    def build(self, number):
+        if number not in self.states:
+            return None
+        frame=self.counties(number)
+        if frame is None or frame.empty:
+            return None
+        return store.county_area(frame, self.totals.get(number))
+
+    def load(self, number):
+        area=self.build(number)
+        if area is None:
+            return None
+        shapes=self.shapes(number) or dict()
+        shapes=dict(shapes, bytes=sum(len(json.dumps(collection)) for collection in shapes.values()))
+        return area, shapes, area_bytes(area, shapes)
+
+    def entry(self, number):
+        if number not in self.states:
+            return None
+        with self.lock:
+            if number in self.cache:
+                self.cache.move_to_end(number)
+                self.counts['hits']+=1
+                return self.cache[number]
+        start=time.time()
+        entry=self.load(number)
+        with self.lock:
+            self.counts['loads']+=1
+            self.counts['load_ms']+=int((time.time()-start)*1000)
+            if entry is None or number in self.cache:
+                return self.cache.get(number, entry)
+            self.cache[number]=entry
+            self.size+=entry[2]
+            while self.size>self.budget and len(self.cache)>1:
+                _, (_, _, size)=self.cache.popitem(last=False)
+                self.size-=size
+                self.counts['evictions']+=1
+        return entry
+
+    def get(self, area):
+        if area in self.areas:
+            return self.areas[area]
+        entry=self.entry(area)
+        return entry and entry[0]
+
+    # The Area get() would return, but a state that is not cached is built
+    # without its shapes and not cached, so a pass over every state (an
+    # export) neither evicts the states being browsed nor reads shapes.
+    def read(self, area):
+        if area in self.areas:
+            return self.areas[area]
+        with self.lock:
+            if area in self.cache:
+                return self.cache[area][0]
+        return self.build(area)
+
+    # The number of counties get() serves for a state, counted from the FIPS
+    # codes of its rows without building (or caching) the state.
+    def count(self, number):
+        with self.lock:
+            if number in self.cache:
+                return len(self.cache[number][0].timeline.labels)
+            if number in self.sizes:
+                return self.sizes[number]
+        if number not in self.states:
+            return 0
+        frame=self.counties(number)
+        size=0 if frame is None or frame.empty else int(frame['FIPS'].nunique())
+        with self.lock:
+            self.sizes[number]=size
+        return size
+
+    # A state's FeatureCollection at a geo.LEVELS level or 'full'.
+    def geojson(self, area, level):
+        entry=self.entry(area)
+        return entry[1].get(level, dict()) if entry else dict()
+
+    def report(self):
+        with self.lock:
+            return {'cached':list(self.cache), 'bytes':self.size, 'budget':self.budget, **self.counts}
+
+# df and df_states are kept as the fact tables of schema.compact, their
+# per-location attributes in the areas' dimensions. With df_us and df_geo
+# None the states are read from the partitioned snapshot at path/version,
+# otherwise they are sliced out of the frames in memory (and geo_levels
+# simplified here when the snapshot has none, or there is no snapshot).
+# `served` are the World and USA areas and the totals as
+# snapshot.read_served maps them; without them they are built here.
+def bundle(df, df_states, df_us, df_geo, version, geo_levels=None, path=None, served=None):
+    if df_us is None:
+        areas, totals=served or store.served(df, df_states)
+        counties=lambda number: snapshot.read_partition(number, path=path, version=version)
+        shapes=lambda number: snapshot.read_shapes(number, path, version)
+        spans=snapshot.read_spans(path, version)
+    else:
+        totals=store.area_totals(df, df_states)
+        df, df_states, df_us, dates, timelines, locations=store.prepare(df, df_states, df_us, totals)
+        areas={name:store.area(frame, table, dates[name], timelines[name], locations[name])
+               for name, table, frame in [('World', 'df', df), ('USA', 'df_states', df_states)]}
+        runs={number:(min(rows.values())[0], max(rows.values())[1]) for number, rows in dates.items()
+              if number not in areas and rows}
+        counties=lambda number: df_us.iloc[slice(*runs[number])] if number in runs else None
+        geo_levels=geo_levels or geo.levels(df_geo)
+        shapes=lambda number: (dict(full=df_geo[number], **{name:level[number] for name, level in geo_levels.items()})
+                               if number in df_geo else None)
+        spans=geo.spans(df_geo)
+    consistency=store.consistency({name:area.timeline for name, area in areas.items()})
+    if consistency['mismatches']:
+        print(f'{version}: county sums differ from the USA row on {len(consistency["mismatches"])} of '
+              f'{consistency["checked"]} dates and metrics', file=sys.stderr)
+    return Frames(areas['World'].facts, areas['USA'].facts, version, Areas(areas, counties, shapes, totals),
+                  spans, consistency)
+
+# Keeps the frames the app serves and swaps in newer snapshots from a
+# background thread. Every worker polls the snapshot's CURRENT pointer; the one
+# holding ingest.lock also runs ingest.py when the last ingest is older than
+# the interval, so the upstream files are fetched once per interval, not once
+# per worker. Callbacks should read `frames` once per request: the swap is a
+# single attribute assignment, so a request keeps the bundle it started with.
+# `path` defaults to snapshot.SNAPSHOT_DIR as it is when the Refresher is made.
+class Refresher:
+    def __init__(self, path=None, interval=REFRESH_INTERVAL):
+        self.path=path=path or snapshot.SNAPSHOT_DIR
+        self.interval=interval
+        self.on_swap=[]
+        start=time.time()
+        frames=snapshot.load(path, counties=False)
+        version=snapshot.current(path)
+        self.pin(version)
+        self.frames=self.bundle(frames, version)
+        self.loaded_at=time.time()
+        self.load_seconds=self.loaded_at-start
+        self.last_check=None
+        self.last_ingest=None
+        self.thread=None
+
+    # Keeps `version` from being pruned while this process serves it.
+    def pin(self, version):
+        if version is None:
+            return
+        try:
+            snapshot.pin(version, self.path)
+        except OSError as e:
+            print(f'could not pin snapshot {version} ({e})', file=sys.stderr)
+
+    def bundle(self, frames, version):
+        geo_levels=snapshot.read_geo(self.path, version) if frames[3] is not None and version else None
+        served=snapshot.read_served(self.path, version) if frames[2] is None and version else None
+        return bundle(*frames, version, geo_levels, self.path, served)
+
+    def ingest(self):
+        lock=os.path.join(self.path, 'ingest.lock')
+        with open(lock, 'a+') as f:
+            try:
+                fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                return
+            f.seek(0)
+            if time.time()-float(f.read() or 0) < self.interval:
+                return
+            start=time.time()
+            version, rows=ingest.ingest(self.path)
+            f.truncate(0)
+            f.write(str(start))
+            self.last_ingest={'version':version, 'rows':rows, 'at':start, 'seconds':time.time()-start}
+
+    def check(self):
+        self.last_check=time.time()
+        version=snapshot.current(self.path)
+        if version is None or version==self.frames.version:
+            return False
+        start=time.time()
+        self.pin(version)
+        frames=self.bundle(snapshot.read(self.path, version, counties=False), version)
+        self.frames=frames
+        self.loaded_at=time.time()
+        self.load_seconds=self.loaded_at-start
+        for callback in self.on_swap:
+            callback(frames)
+        return True
+
+    def run(self):
+        while True:
+            time.sleep(self.interval)
+            try:
+                self.ingest()
+                self.check()
+            except Exception:
+                traceback.print_exc(file=sys.stderr)
+
+    # Call in each serving process, after any fork.
+    def start(self):
+        if self.interval and self.thread is None:
+            os.makedirs(self.path, exist_ok=True)
+            self.thread=threading.Thread(target=self.run, name='refresher', daemon=True)
+            self.thread.start()
+
+    def status(self):
+        return {
+            'version':self.frames.version,
+            'loaded_at':self.loaded_at,
+            'load_seconds':self.load_seconds,
+            'last_check':self.last_check,
+            'last_ingest':self.last_ingest,
+            'refresh_interval':self.interval,
+            'consistency_mismatches':len(self.frames.consistency['mismatches']),
+            'areas':self.frames.areas.report(),
+        }
@@ -0,0 +1,114 @@
+import os
+import sys
+import time
+import shutil
+import argparse
+import subprocess
+import multiprocessing
+
+WORKERS = os.cpu_count()
+FFMPEG = os.environ.get('FFMPEG', 'ffmpeg')
+# encoder arguments by extension of the --video file
+CODECS = {
+    '.mp4':['-c:v', 'libx264', '-pix_fmt', 'yuv420p', '-crf', '20'],
+    '.webm':['-c:v', 'libvpx-vp9', '-b:v', '0', '-crf', '32'],
+    '.gif':['-filter_complex', '[0:v]split[a][b];[a]palettegen[p];[b][p]paletteuse', '-loop', '0'],
+    '.webp':['-c:v', 'libwebp_anim', '-loop', '0', '-quality', '80'],
+}
+
+# Renders one image per date on a forked process pool. Every worker builds
+# its figure once and only swaps the traces per frame, and keeps its own
+# kaleido process, so neither is started again for every frame. Frames
+# already on disk are skipped, so an interrupted export picks up where it
+# stopped; a frame is written under a temporary name first and renamed, so a
+# killed worker never leaves a truncated image behind.
+_figure = None
+_draw = None
+_size = None
+
+def frame_name(out, date):
+    return os.path.join(out, f'{str(date)[:10]}.png')
+
+def _start(figure, draw, width, height):
+    global _figure, _draw, _size
+    _figure, _draw, _size=figure(), draw, (width, height)
+
+def _render(task):
+    date, name=task
+    _draw(_figure, date)
+    tmp=name[:-4]+'.tmp.png'
+    _figure.write_image(tmp, width=_size[0], height=_size[1])
+    os.replace(tmp, name)
+    return name
+
+def _image(date):
+    _draw(_figure, date)
+    return _figure.to_image(format='png', width=_size[0], height=_size[1])
+
+# Streams the frames, in date order, as PNGs into an ffmpeg process that
+# encodes them straight into one video or animation; nothing is written per
+# frame, so disk use is the size of the output file.
+def encode(figure, draw, dates, video, workers=WORKERS, width=3840, height=2160, fps=10, log=sys.stderr):
+    ext=os.path.splitext(video)[1]
+    if ext not in CODECS:
+        raise ValueError(f'{video}: the video has to be one of {", ".join(CODECS)}')
+    if shutil.which(FFMPEG) is None:
+        raise FileNotFoundError(f'{FFMPEG} not found, set FFMPEG to the ffmpeg binary')
+    # yuv420p needs even sizes, so an odd width or height loses a pixel
+    scale=['-vf', 'scale=trunc(iw/2)*2:trunc(ih/2)*2'] if ext in ['.mp4', '.webm'] else []
+    encoder=subprocess.Popen([FFMPEG, '-y', '-loglevel', 'error', '-f', 'image2pipe', '-framerate', str(fps),
+                              '-c:v', 'png', '-i', '-', *scale, *CODECS[ext], video], stdin=subprocess.PIPE)
+    report={'frames':len(dates), 'rendered':0, 'workers':workers, 'bytes_in':0}
+    start=time.time()
+    try:
+        with multiprocessing.get_context('fork').Pool(workers, _start, (figure, draw, width, height)) as pool:
+            for image in pool.imap(_image, dates):
+                encoder.stdin.write(image)
+                report['rendered']+=1
+                report['bytes_in']+=len(image)
+                elapsed=time.time()-start
+                print(f'{video} {report["rendered"]}/{len(dates)} {report["rendered"]/elapsed:.2f} frames/s', file=log)
+    except BaseException:
+        encoder.stdin.close()
+        encoder.wait()
+        raise
+    encoder.stdin.close()
+    if encoder.wait():
+        raise RuntimeError(f'{FFMPEG} exited with {encoder.returncode}')
+    report['seconds']=time.time()-start
+    report['frames_per_s']=report['rendered']/report['seconds'] if report['rendered'] else 0
+    report['bytes_out']=os.path.getsize(video)
+    print(f'encoded {report}', file=log)
+    return report
+
+# figure() builds the reusable figure, draw(fig, date) puts a date's traces on it.
+def render(figure, draw, dates, out, workers=WORKERS, width=3840, height=2160, force=False, log=sys.stderr):
+    os.makedirs(out, exist_ok=True)
+    todo=[(date, frame_name(out, date)) for date in dates]
+    if not force:
+        todo=[(date, name) for date, name in todo if not os.path.exists(name)]
+    report={'frames':len(dates), 'skipped':len(dates)-len(todo), 'rendered':0, 'workers':workers}
+    start=time.time()
+    with multiprocessing.get_context('fork').Pool(workers, _start, (figure, draw, width, height)) as pool:
+        for name in pool.imap_unordered(_render, todo):
+            report['rendered']+=1
+            elapsed=time.time()-start
+            print(f'{name} {report["rendered"]}/{len(todo)} {report["rendered"]/elapsed:.2f} frames/s', file=log)
+    report['seconds']=time.time()-start
+    report['frames_per_s']=report['rendered']/report['seconds'] if report['rendered'] else 0
+    print(f'rendered {report}', file=log)
+    return report
+
+def main(figure, draw, dates, out, description=None):
+    parser=argparse.ArgumentParser(description=description)
+    parser.add_argument('--out', default=out, help='directory for the frames')
+    parser.add_argument('--workers', type=int, default=WORKERS)
+    parser.add_argument('--width', type=int, default=3840)
+    parser.add_argument('--height', type=int, default=2160)
+    parser.add_argument('--force', action='store_true', help='render frames that already exist again')
+    parser.add_argument('--video', help=f'encode into this file ({", ".join(CODECS)}) instead of writing frames')
+    parser.add_argument('--fps', type=float, default=10, help='frame rate of --video')
+    args=parser.parse_args()
+    if args.video:
+        return encode(figure, draw, dates, args.video, args.workers, args.width, args.height, args.fps)
+    return render(figure, draw, dates, args.out, args.workers, args.width, args.height, args.force)
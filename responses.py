@@ -0,0 +1,149 @@
+import os
+import gzip
+import json
+import hashlib
+import threading
+from collections import OrderedDict, Counter
+import flask
+import metrics
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# Memory the encoded responses may take per process before the least recently
+# used are dropped.
+RESPONSE_CACHE = int(os.environ.get('RESPONSE_CACHE_MB', '64'))*2**20
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 5
+IMMUTABLE = 'public, max-age=31536000, immutable'
+
+# A response body in every encoding the server offers, encoded once and kept
+# until its data version goes out of use. The ETag is strong, one per
+# encoding, derived from the unencoded bytes.
+class Body:
+    def __init__(self, data):
+        self.digest=hashlib.sha256(data).hexdigest()[:20]
+        self.encodings={'identity':data, 'gzip':gzip.compress(data, GZIP_LEVEL, mtime=0)}
+        if brotli is not None:
+            self.encodings['br']=brotli.compress(data, quality=BROTLI_QUALITY)
+        self.size=sum(len(body) for body in self.encodings.values())
+        # metrics labels of the callback that produced a stored response
+        self.labels=None
+
+    def etag(self, encoding):
+        return f'"{self.digest}-{encoding}"'
+
+    def encoding(self, accept):
+        accepted={part.split(';')[0].strip() for part in accept.split(',')}
+        return next((name for name in ['br', 'gzip'] if name in accepted and name in self.encodings), 'identity')
+
+    # The response for the current request: 304 when its If-None-Match holds
+    # the ETag of the encoding it would get.
+    def response(self, mimetype='application/json', cache_control=None):
+        encoding=self.encoding(flask.request.headers.get('Accept-Encoding', ''))
+        etag=self.etag(encoding)
+        if etag in flask.request.headers.get('If-None-Match', ''):
+            response=flask.Response(status=304)
+        else:
+            response=flask.Response(self.encodings[encoding], mimetype=mimetype)
+            if encoding!='identity':
+                response.headers['Content-Encoding']=encoding
+        response.headers['ETag']=etag
+        response.headers['Vary']='Accept-Encoding'
+        if cache_control:
+            response.headers['Cache-Control']=cache_control
+        return response
+
+# Bodies by key, in an LRU of at most `budget` bytes. Keys start with the data
+# version, and `drop` removes every other version's entries on a refresh.
+class Bodies:
+    def __init__(self, budget=RESPONSE_CACHE):
+        self.budget=budget
+        self.lock=threading.Lock()
+        self.cache=OrderedDict()
+        self.size=0
+        self.counts=Counter()
+
+    def get(self, key, build=None):
+        with self.lock:
+            if key in self.cache:
+                self.cache.move_to_end(key)
+                self.counts['hits']+=1
+                return self.cache[key]
+            self.counts['misses']+=1
+        if build is None:
+            return None
+        body=Body(build())
+        self.put(key, body)
+        return body
+
+    def put(self, key, body):
+        with self.lock:
+            if key in self.cache:
+                return
+            self.cache[key]=body
+            self.size+=body.size
+            while self.size>self.budget and len(self.cache)>1:
+                _, dropped=self.cache.popitem(last=False)
+                self.size-=dropped.size
+
+    def drop(self, version):
+        with self.lock:
+            for key in [key for key in self.cache if key[0]!=version]:
+                self.size-=self.cache.pop(key).size
+
+    def report(self):
+        with self.lock:
+            return {'entries':len(self.cache), 'bytes':self.size, 'budget':self.budget,
+                    'encodings':['br', 'gzip'] if brotli else ['gzip'], **self.counts}
+
+bodies = Bodies()
+
+def dumps(value):
+    return json.dumps(value, separators=(',', ':')).encode()
+
+# Key of a Dash callback request: its output with the values of its inputs
+# and state. changedPropIds is left out, none of the cached callbacks read it.
+def callback_key(version, body):
+    request=[body.get('output'), [item.get('value') for item in body.get('inputs', [])],
+             [item.get('value') for item in body.get('state', [])]]
+    return (version, 'callback', hashlib.sha256(dumps(request)).hexdigest())
+
+# Serves the responses of the callbacks with `outputs` from `bodies`:
+# before_request answers a request it has seen for the data version, and
+# after_request stores a new response encoded. An answered request never
+# reaches the callback, so it is counted in metrics with the labels of the
+# request that stored the response.
+class Callbacks:
+    def __init__(self, server, outputs, version, path='/_dash-update-component'):
+        self.outputs=set(outputs)
+        self.version=version
+        self.path=path
+        server.before_request(self.before_request)
+        server.after_request(self.after_request)
+
+    def before_request(self):
+        request=flask.request
+        if request.method!='POST' or request.path!=self.path:
+            return None
+        body=request.get_json(silent=True) or dict()
+        if body.get('output') not in self.outputs:
+            return None
+        key=callback_key(self.version(), body)
+        cached=bodies.get(key)
+        if cached:
+            if cached.labels:
+                metrics.served(cached.labels)
+            return cached.response()
+        flask.g.response_key=key
+        return None
+
+    def after_request(self, response):
+        key=flask.g.pop('response_key', None)
+        if key is None or response.status_code!=200 or response.headers.get('Content-Encoding'):
+            return response
+        body=Body(response.get_data())
+        body.labels=metrics.request_labels()
+        bodies.put(key, body)
+        return body.response()
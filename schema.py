@@ -0,0 +1,60 @@
+import numpy as np
+import pandas as pd
+
+# The layout the app keeps the frames in once they are loaded. Every frame is
+# split into a fact table, one row per location and date, and a dimension
+# table, one row per location, joined by an integer key: the location's
+# position in the dimension. Attributes that never change for a location
+# (names, codes, coordinates, population) are stored once in the dimension
+# instead of on every date; an attribute that turns out to vary is left on
+# the facts. Counts and rates become int32 where they fit.
+SCHEMA = {
+    'df': {'key':'iso3', 'dimensions':['iso3', 'Country/Region', 'Population']},
+    'df_states': {'key':'Province_State',
+                  'dimensions':['Province_State', 'abbreviation', 'number', 'Population', 'Lat', 'Long_']},
+    'df_us': {'key':'FIPS', 'dimensions':['FIPS', 'Admin2', 'Province_State', 'number', 'Population', 'Lat', 'Long_']},
+}
+
+def downcast(values):
+    if values.dtype.kind in 'iuf' and len(values) and not np.isnan(values.astype(float)).any():
+        if np.array_equal(values, np.round(values)):
+            for dtype in ['int32', 'uint32']:
+                info=np.iinfo(dtype)
+                if values.min()>=info.min and values.max()<=info.max:
+                    return values.astype(dtype)
+    return values
+
+def constant(values, codes, first):
+    values=pd.Series(values)
+    return values.reset_index(drop=True).equals(values.iloc[first[codes]].reset_index(drop=True))
+
+# (facts, dimension) for a frame in the row order it is served in.
+def compact(frame, key, dimensions):
+    codes, labels=pd.factorize(frame[key], sort=True)
+    _, first=np.unique(codes, return_index=True)
+    dimensions=[col for col in dimensions if col in frame and constant(frame[col], codes, first)]
+    dimension=pd.DataFrame({col:frame[col].iloc[first].to_numpy() for col in dimensions})
+    for col in dimension:
+        dimension[col]=dimension[col].astype('category') if dimension[col].dtype==object else downcast(dimension[col].to_numpy())
+    facts={'loc':codes.astype('int16' if len(labels)<2**15 else 'int32')}
+    for col in frame:
+        if col not in dimensions:
+            facts[col]=frame[col].to_numpy() if col=='date' else downcast(frame[col].to_numpy())
+    return pd.DataFrame(facts), dimension
+
+# Rows start:stop of the facts joined with their dimension, in the column-lists
+# shape of DataFrame.to_dict('list'). `skip` are fact columns left out.
+def rows(facts, dimension, start, stop, skip=()):
+    part=facts.iloc[start:stop]
+    codes=part['loc'].to_numpy()
+    result={col:dimension[col].to_numpy()[codes].tolist() for col in dimension}
+    for col in part:
+        if col!='loc' and col not in skip:
+            result[col]=part[col].tolist()
+    return result
+
+def bytes_per_row(frame, dimension=None):
+    total=frame.memory_usage(deep=True, index=False).sum()
+    if dimension is not None:
+        total+=dimension.memory_usage(deep=True, index=False).sum()
+    return total/len(frame) if len(frame) else 0
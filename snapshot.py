@@ -0,0 +1,370 @@
+import os
+import sys
+import json
+import shutil
+import hashlib
+from datetime import datetime
+import numpy as np
+import pandas as pd
+import pipeline
+import store
+import geo
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+SNAPSHOT_DIR = os.environ.get('SNAPSHOT_DIR', os.path.join(ROOT, 'snapshot'))
+FRAMES = ['df', 'df_states', 'df_us']
+KEEP = 3
+
+# A snapshot is a directory per version holding one folder per frame. Columns
+# sharing a dtype are stored together as one 2-D .npy block, which is exactly
+# how pandas lays them out internally, so the frame can be built on top of the
+# memory-mapped files without a copy. String columns are stored as categorical
+# codes plus their categories. Frames come back with their columns grouped by
+# dtype; reordering them would force pandas to copy the blocks.
+def write_frame(frame, path):
+    os.makedirs(path)
+    blocks=dict()
+    columns=[]
+    for col in frame.columns:
+        values=frame[col]
+        if values.dtype==object or isinstance(values.dtype, pd.CategoricalDtype):
+            values=pd.Categorical(values)
+            np.save(os.path.join(path, f'{len(columns)}.npy'), values.codes)
+            columns.append({'name':col, 'kind':'category', 'categories':values.categories.tolist()})
+        else:
+            blocks.setdefault(values.dtype.str, []).append(col)
+    for i, (dtype, names) in enumerate(blocks.items()):
+        np.save(os.path.join(path, f'block{i}.npy'), np.stack([frame[col].to_numpy() for col in names]))
+        columns.append({'name':names, 'kind':'block', 'file':f'block{i}.npy'})
+    with open(os.path.join(path, 'meta.json'), 'w') as f:
+        json.dump({'rows':len(frame), 'columns':columns}, f)
+
+def read_frame(path, mmap_mode='r'):
+    with open(os.path.join(path, 'meta.json')) as f:
+        meta = json.load(f)
+    parts=[]
+    for i, col in enumerate(meta['columns']):
+        if col['kind']=='category':
+            codes=np.load(os.path.join(path, f'{i}.npy'), mmap_mode=mmap_mode)
+            parts.append(pd.DataFrame({col['name']:pd.Categorical.from_codes(codes, col['categories'])}, copy=False))
+        else:
+            values=np.load(os.path.join(path, col['file']), mmap_mode=mmap_mode)
+            parts.append(pd.DataFrame(values.T, columns=col['name'], copy=False))
+    if not parts:
+        return pd.DataFrame(index=range(meta['rows']))
+    return pd.concat(parts, axis=1, copy=False)
+
+# The counties are stored as one frame per state (PARTITION value, the state
+# number that also keys df_geo), so a process can read only the states it
+# serves. read_partitions puts the whole frame back together.
+PARTITION = {'df_us':'number'}
+
+def write_partitions(frame, key, path):
+    os.makedirs(path)
+    partitions=dict()
+    for value, part in frame.groupby(key, sort=True, observed=True):
+        write_frame(part.reset_index(drop=True), os.path.join(path, str(value)))
+        partitions[str(value)]=len(part)
+    with open(os.path.join(path, 'partitions.json'), 'w') as f:
+        json.dump({'key':key, 'partitions':partitions}, f)
+
+def partitions(path):
+    try:
+        with open(os.path.join(path, 'partitions.json')) as f:
+            return json.load(f)['partitions']
+    except FileNotFoundError:
+        return None
+
+def read_partitions(path, mmap_mode='r'):
+    names=partitions(path)
+    if names is None:
+        return read_frame(path, mmap_mode)
+    if not names:
+        return pd.DataFrame()
+    frame=pd.concat([read_frame(os.path.join(path, name), mmap_mode) for name in names], ignore_index=True)
+    return frame.astype({col:'category' for col in frame if frame[col].dtype==object})
+
+# One state's counties, None when the snapshot is not partitioned or has no
+# rows for that state.
+def read_partition(value, name='df_us', path=SNAPSHOT_DIR, version=None):
+    version=version or current(path)
+    target=os.path.join(path, version, name)
+    names=partitions(target)
+    if not names or value not in names:
+        return None
+    return read_frame(os.path.join(target, value))
+
+def partitioned(path=SNAPSHOT_DIR, version=None):
+    version=version or current(path)
+    return (version is not None and partitions(os.path.join(path, version, 'df_us')) is not None
+            and os.path.exists(os.path.join(path, version, 'geo', 'spans.json')))
+
+def current(path=SNAPSHOT_DIR):
+    try:
+        with open(os.path.join(path, 'CURRENT')) as f:
+            return f.read().strip()
+    except FileNotFoundError:
+        return None
+
+# The wide, aggregated JHU matrices the frames were melted from, kept so that
+# ingest.py can diff the next download against them.
+def write_sources(df_lookup, wide, path):
+    os.makedirs(path)
+    meta={'lookup':lookup_hash(df_lookup), 'wide':dict()}
+    for name, frame in wide.items():
+        write_frame(frame.reset_index(), os.path.join(path, name))
+        meta['wide'][name]={'index':list(frame.index.names), 'columns':list(frame.columns)}
+    with open(os.path.join(path, 'meta.json'), 'w') as f:
+        json.dump(meta, f)
+
+def read_sources(path=SNAPSHOT_DIR, version=None):
+    version=version or current(path)
+    if version is None or not os.path.exists(os.path.join(path, version, 'sources')):
+        return None
+    path=os.path.join(path, version, 'sources')
+    with open(os.path.join(path, 'meta.json')) as f:
+        meta = json.load(f)
+    wide=dict()
+    for name, spec in meta['wide'].items():
+        frame=read_frame(os.path.join(path, name))
+        frame=frame.astype({col:object for col in spec['index'] if isinstance(frame[col].dtype, pd.CategoricalDtype)})
+        wide[name]=frame.set_index(spec['index'])[spec['columns']]
+    return meta['lookup'], wide
+
+def lookup_hash(df_lookup):
+    return hashlib.sha1(pd.util.hash_pandas_object(df_lookup, index=False).values.tobytes()).hexdigest()
+
+# The county shapes as downloaded (geo.json, for the exporters) and, per
+# state, the downloaded shapes with the simplified levels of geo.py next to
+# them plus every state's span. The levels only depend on the shapes, so while
+# those stay the same (every ingest) they are copied from the previous version
+# instead of recomputed.
+def write_geo(df_geo, path, previous=None):
+    text=json.dumps(df_geo)
+    with open(os.path.join(path, 'geo.json'), 'w') as f:
+        f.write(text)
+    meta={'sha1':hashlib.sha1(text.encode()).hexdigest(), 'levels':[list(level) for level in geo.LEVELS]}
+    if previous is not None and os.path.exists(os.path.join(previous, 'geo', 'spans.json')):
+        with open(os.path.join(previous, 'geo', 'meta.json')) as f:
+            if json.load(f)==meta:
+                shutil.copytree(os.path.join(previous, 'geo'), os.path.join(path, 'geo'))
+                return
+    os.makedirs(os.path.join(path, 'geo', 'states'))
+    levels=geo.levels(df_geo)
+    for area, collection in df_geo.items():
+        with open(os.path.join(path, 'geo', 'states', f'{area}.json'), 'w') as f:
+            f.write(json.dumps({'full':collection, **{name:levels[name][area] for name in levels}}))
+    with open(os.path.join(path, 'geo', 'spans.json'), 'w') as f:
+        json.dump(geo.spans(df_geo), f)
+    with open(os.path.join(path, 'geo', 'meta.json'), 'w') as f:
+        json.dump(meta, f)
+
+# {level: {state: FeatureCollection}}, None for a snapshot written before the levels.
+def read_geo(path=SNAPSHOT_DIR, version=None):
+    version=version or current(path)
+    if version is None or not os.path.exists(os.path.join(path, version, 'geo', 'meta.json')):
+        return None
+    target=os.path.join(path, version, 'geo')
+    result={name:dict() for name, _, _ in geo.LEVELS}
+    if not os.path.exists(os.path.join(target, 'states')):
+        for name in result:
+            with open(os.path.join(target, f'{name}.json')) as f:
+                result[name]=json.load(f)
+        return result
+    for file in os.listdir(os.path.join(target, 'states')):
+        shapes=read_shapes(file[:-len('.json')], path, version)
+        for name in result:
+            result[name][file[:-len('.json')]]=shapes[name]
+    return result
+
+# {level: FeatureCollection} of one state, 'full' included, or None.
+def read_shapes(area, path=SNAPSHOT_DIR, version=None):
+    version=version or current(path)
+    try:
+        with open(os.path.join(path, version, 'geo', 'states', f'{area}.json')) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+def read_spans(path=SNAPSHOT_DIR, version=None):
+    version=version or current(path)
+    with open(os.path.join(path, version, 'geo', 'spans.json')) as f:
+        return json.load(f)
+
+# The areas the app serves straight from the snapshot (store.served): per
+# area its fact and dimension frames, its timeline matrices stacked into one
+# .npy (metric, location, date) and its Locations codes, plus the totals of
+# every area as one frame with each area's rows. Memory-mapped like the
+# frames, so the workers share them after a refresh too.
+def write_served(df, df_states, path):
+    areas, totals=store.served(df, df_states)
+    for name, area in areas.items():
+        target=os.path.join(path, name)
+        write_frame(area.facts, os.path.join(target, 'facts'))
+        write_frame(area.dimension, os.path.join(target, 'dimension'))
+        timeline, locations=area.timeline, area.locations
+        np.save(os.path.join(target, 'timeline.npy'), np.stack(list(timeline.values.values())))
+        if timeline.total is not None:
+            np.save(os.path.join(target, 'total.npy'), np.stack([timeline.total[col] for col in timeline.values]))
+        np.save(os.path.join(target, 'codes.npy'), locations.codes)
+        with open(os.path.join(target, 'meta.json'), 'w') as f:
+            json.dump({'labels':timeline.labels, 'dates':timeline.dates, 'columns':list(timeline.values),
+                       'attributes':locations.attributes, 'offset':locations.offset}, f)
+    runs, start=dict(), 0
+    for name, frame in totals.items():
+        runs[name]=(start, start+len(frame))
+        start+=len(frame)
+    write_frame(pd.concat(totals.values(), ignore_index=True), os.path.join(path, 'totals'))
+    with open(os.path.join(path, 'totals.json'), 'w') as f:
+        json.dump(runs, f)
+
+# (areas, totals) as store.served returns them, None for a snapshot written
+# before them.
+def read_served(path=SNAPSHOT_DIR, version=None):
+    version=version or current(path)
+    if version is None or not os.path.exists(os.path.join(path, version, 'served', 'totals.json')):
+        return None
+    path=os.path.join(path, version, 'served')
+    areas=dict()
+    for name in ['World', 'USA']:
+        target=os.path.join(path, name)
+        with open(os.path.join(target, 'meta.json')) as f:
+            meta=json.load(f)
+        facts=read_frame(os.path.join(target, 'facts'))
+        values=np.asarray(np.load(os.path.join(target, 'timeline.npy'), mmap_mode='r'))
+        total=None
+        if os.path.exists(os.path.join(target, 'total.npy')):
+            total=dict(zip(meta['columns'], np.asarray(np.load(os.path.join(target, 'total.npy'), mmap_mode='r'))))
+        timeline=store.Timeline(meta['labels'], meta['dates'], dict(zip(meta['columns'], values)), total)
+        locations=store.Locations(meta['attributes'], np.asarray(np.load(os.path.join(target, 'codes.npy'), mmap_mode='r')),
+                                  meta['offset'])
+        areas[name]=store.Area(facts, read_frame(os.path.join(target, 'dimension')), store.date_runs(facts['date']),
+                               timeline, locations)
+    frame=read_frame(os.path.join(path, 'totals'))
+    with open(os.path.join(path, 'totals.json')) as f:
+        totals={name:frame.iloc[start:stop] for name, (start, stop) in json.load(f).items()}
+    return areas, totals
+
+def write(df, df_states, df_us, df_geo, path=SNAPSHOT_DIR, keep=KEEP, sources=None):
+    version=datetime.utcnow().strftime('%Y%m%dT%H%M%S%f')
+    target=os.path.join(path, version)
+    tmp=target+'.tmp'
+    shutil.rmtree(tmp, ignore_errors=True)
+    for name, frame in zip(FRAMES, [df, df_states, df_us]):
+        if name in PARTITION:
+            write_partitions(store.sort(frame, store.ORDER[name]), PARTITION[name], os.path.join(tmp, name))
+        else:
+            write_frame(store.sort(frame, store.ORDER[name]), os.path.join(tmp, name))
+    write_served(df, df_states, os.path.join(tmp, 'served'))
+    previous=current(path)
+    write_geo(df_geo, tmp, os.path.join(path, previous) if previous else None)
+    if sources is not None:
+        write_sources(*sources, os.path.join(tmp, 'sources'))
+    shutil.rmtree(target, ignore_errors=True)
+    os.rename(tmp, target)
+    with open(os.path.join(path, 'CURRENT.tmp'), 'w') as f:
+        f.write(version)
+    os.replace(os.path.join(path, 'CURRENT.tmp'), os.path.join(path, 'CURRENT'))
+    versions=sorted(x for x in os.listdir(path) if os.path.isdir(os.path.join(path, x)) and not x.endswith('.tmp'))
+    live=pinned(path)
+    for old in versions[:-keep]:
+        if old not in live:
+            shutil.rmtree(os.path.join(path, old), ignore_errors=True)
+    return version
+
+# A serving process reads its version's partitions and shapes long after
+# loading it, so it records the version in PIN.<pid> and write() leaves every
+# version a live process has pinned. Pins of processes that have exited are
+# removed.
+def pin(version, path=SNAPSHOT_DIR):
+    name=os.path.join(path, f'PIN.{os.getpid()}')
+    with open(name+'.tmp', 'w') as f:
+        f.write(version)
+    os.replace(name+'.tmp', name)
+
+def pinned(path=SNAPSHOT_DIR):
+    versions=set()
+    for name in os.listdir(path):
+        pid=name[len('PIN.'):]
+        if not name.startswith('PIN.') or not pid.isdigit():
+            continue
+        try:
+            os.kill(int(pid), 0)
+        except ProcessLookupError:
+            os.remove(os.path.join(path, name))
+            continue
+        except PermissionError:
+            pass
+        try:
+            with open(os.path.join(path, name)) as f:
+                versions.add(f.read().strip())
+        except FileNotFoundError:
+            pass
+    return versions
+
+# With counties=False a partitioned snapshot leaves out df_us and df_geo
+# (None), to be read a state at a time.
+def read(path=SNAPSHOT_DIR, version=None, counties=True):
+    version=version or current(path)
+    if version is None:
+        return None
+    target=os.path.join(path, version)
+    if not counties and partitioned(path, version):
+        return read_frame(os.path.join(target, 'df')), read_frame(os.path.join(target, 'df_states')), None, None
+    frames=[read_partitions(os.path.join(target, name)) for name in FRAMES]
+    with open(os.path.join(target, 'geo.json')) as f:
+        df_geo=json.load(f)
+    return (*frames, df_geo)
+
+# An empty frame with the column types of a loaded one, so the stores index
+# it like any other.
+def empty(columns):
+    text={'Province_State', 'abbreviation', 'number', 'FIPS', 'Admin2'}
+    return pd.DataFrame({col:pd.Series(dtype='datetime64[ns]' if col=='date' else object if col in text else float)
+                         for col in columns})
+
+def read_fallback():
+    if os.path.exists(os.path.join(ROOT, 'df.pkl')):
+        df=pd.read_pickle(os.path.join(ROOT, 'df.pkl'))
+    else:
+        df=pd.read_csv(os.path.join(ROOT, 'df.csv'), index_col=0, parse_dates=['date'])
+    df=df.drop(columns=['days'], errors='ignore')
+    df_states=empty(['Province_State', 'date', 'Lat', 'Long_', 'confirmed', 'deaths', 'Population',
+                     'confirmed_rate', 'deaths_rate', 'number', 'abbreviation'])
+    df_us=empty(['FIPS', 'Admin2', 'Province_State', 'Lat', 'Long_', 'date', 'confirmed', 'deaths',
+                 'Population', 'confirmed_rate', 'deaths_rate', 'number'])
+    with open(os.path.join(ROOT, 'map.geojson')) as f:
+        counties=json.load(f)
+    for county in counties['features']:
+        county.setdefault('id', county['properties']['id'])
+    return df, df_states, df_us, pipeline.split_counties(counties)
+
+# Snapshot first, then the live JHU sources, then the files checked into the repo.
+# A live build is persisted and read back so that, like a snapshot, it ends up
+# in memory-mapped pages the gunicorn workers share with the master.
+def load(path=SNAPSHOT_DIR, counties=True):
+    frames=read(path, counties=counties)
+    if frames is not None:
+        return frames
+    try:
+        df_lookup, wide, df_geo=pipeline.load_all()
+        frames=(*pipeline.build_frames(df_lookup, wide), df_geo)
+    # an unreachable server, or a truncated or HTML response that does not
+    # parse or lacks the expected columns
+    except (OSError, KeyError, ValueError, pd.errors.ParserError, json.JSONDecodeError) as e:
+        print(f'live load failed ({e}), using df.pkl/map.geojson', file=sys.stderr)
+        return read_fallback()
+    try:
+        os.makedirs(path, exist_ok=True)
+        return read(path, write(*frames, path=path, sources=(df_lookup, wide)), counties)
+    except OSError as e:
+        print(f'could not write snapshot ({e})', file=sys.stderr)
+        return frames
+
+def build(path=SNAPSHOT_DIR, input_url=pipeline.INPUT_URL, counties_url=pipeline.COUNTIES_URL, keep=KEEP):
+    os.makedirs(path, exist_ok=True)
+    df_lookup, wide, df_geo=pipeline.load_all(input_url, counties_url)
+    return write(*pipeline.build_frames(df_lookup, wide), df_geo, path=path, keep=keep, sources=(df_lookup, wide))
+
+if __name__ == '__main__':
+    print(build(sys.argv[1] if len(sys.argv)>1 else SNAPSHOT_DIR))
@@ -0,0 +1,308 @@
+import base64
+from collections import namedtuple, defaultdict
+import numpy as np
+import pandas as pd
+import schema
+
+METRICS = ['confirmed', 'deaths', 'recovered']
+# Series derived from each metric by derive(): daily increments, their 7-day
+# trailing mean and the doubling time in days over the last 7 days. A series
+# has a per-1e9-population '_rate' column except for the doubling time.
+DERIVED = ['new', 'avg7', 'doubling']
+WINDOW = 7
+
+# Row order of each frame in memory and on disk. Every date (and, for the
+# counties, every state's date) is one contiguous run of rows, so a slider
+# tick is an iloc slice. Within each location the rows stay in date order.
+ORDER = {
+    'df': ['date', 'iso3'],
+    'df_states': ['date', 'Province_State'],
+    'df_us': ['number', 'date', 'FIPS'],
+}
+
+def sort_codes(values):
+    if isinstance(values.dtype, pd.CategoricalDtype) and values.cat.categories.is_monotonic_increasing:
+        return values.cat.codes.to_numpy()
+    if np.issubdtype(values.dtype, np.datetime64):
+        return values.to_numpy().view('int64')
+    return pd.factorize(values, sort=True)[0]
+
+def sort(frame, keys):
+    if frame.empty:
+        return frame
+    order=np.lexsort([sort_codes(frame[key]) for key in reversed(keys)])
+    if (order[1:]>order[:-1]).all():
+        return frame
+    return frame.take(order).reset_index(drop=True)
+
+# Every series the select-data dropdown offers for a metric.
+def series(metric):
+    return [metric]+[f'{metric}_{name}' for name in DERIVED]
+
+def columns(series):
+    return [series] if series.endswith('_doubling') else [series, f'{series}_rate']
+
+# The numeric columns of a frame a series can be read from, in a fixed order.
+def values(frame):
+    return [col for metric in METRICS for name in series(metric) for col in columns(name) if col in frame]
+
+def derived(values, first):
+    previous=np.c_[np.zeros(len(values)) if first else np.full(len(values), np.nan), values[:, :-1]]
+    new=values-previous
+    avg7=pd.DataFrame(new.T).rolling(WINDOW, min_periods=1).mean().to_numpy().T
+    before=np.c_[np.full((len(values), WINDOW), np.nan), values[:, :-WINDOW]][:, :values.shape[1]]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        doubling=np.where((values>before)&(before>0), WINDOW*np.log(2)/np.log(values/before), np.nan)
+    return {'new':new, 'avg7':avg7, 'doubling':doubling}
+
+# Adds the DERIVED columns of every metric to a frame, one vectorized pass per
+# metric over a locations x dates matrix. With `since`, only the rows from that
+# date on are computed again (reading the WINDOW dates before it), which is
+# all a new day or a revised cell changes. Returns a new frame; the columns of
+# the given one may be read-only memory maps.
+def derive(frame, key, since=None):
+    frame=frame.copy(deep=False)
+    dates=frame['date']
+    rows=np.ones(len(frame), dtype=bool) if since is None else (dates>=since-pd.Timedelta(days=WINDOW)).to_numpy()
+    target=rows if since is None else (dates>=since).to_numpy()[rows]
+    loc_codes, _=pd.factorize(frame[key][rows], sort=True)
+    date_codes, days=pd.factorize(dates[rows], sort=True)
+    shape=(loc_codes.max()+1 if len(loc_codes) else 0, len(days))
+    population=np.full(shape, np.nan)
+    population[loc_codes, date_codes]=frame['Population'].to_numpy()[rows]
+    positions=np.flatnonzero(rows)[target]
+    for metric in METRICS:
+        if metric not in frame:
+            continue
+        matrix=np.full(shape, np.nan)
+        matrix[loc_codes, date_codes]=frame[metric].to_numpy()[rows]
+        for name, values in derived(matrix, since is None).items():
+            result={f'{metric}_{name}':values}
+            if name!='doubling':
+                with np.errstate(divide='ignore', invalid='ignore'):
+                    result[f'{metric}_{name}_rate']=np.trunc(values/population*1000000000)
+            for col, values in result.items():
+                column=frame[col].to_numpy(dtype=float, copy=True) if col in frame else np.full(len(frame), np.nan)
+                column[positions]=values[loc_codes[target], date_codes[target]]
+                frame[col]=column
+    return frame
+
+# {date: (start, stop)} for a frame already sorted by date.
+def date_runs(dates, offset=0):
+    values=dates.to_numpy().view('int64')
+    if not len(values):
+        return dict()
+    starts=np.flatnonzero(np.r_[True, values[1:]!=values[:-1]])
+    stops=np.r_[starts[1:], len(values)]
+    return {int(values[start]):(offset+start, offset+stop) for start, stop in zip(starts, stops)}
+
+# {date: {column: array}} of some columns of a frame, built in one pass so a
+# frame of the exporters is a dict lookup instead of a scan of the frame.
+# Unknown dates get empty columns.
+def by_date(frame, columns):
+    order=np.argsort(frame['date'].to_numpy(), kind='stable')
+    arrays={col:np.asarray(frame[col])[order] for col in columns}
+    result=defaultdict(lambda: {col:values[:0] for col, values in arrays.items()})
+    for date, (start, stop) in date_runs(frame['date'].iloc[order]).items():
+        result[date]={col:values[start:stop] for col, values in arrays.items()}
+    return result
+
+# {area: {date: (start, stop)}} with area being 'World', 'USA' or a state number.
+def date_index(df, df_states, df_us):
+    index={'World':date_runs(df['date']), 'USA':date_runs(df_states['date'])}
+    numbers=df_us['number'].to_numpy() if df_us is not None else []
+    if len(numbers):
+        starts=np.flatnonzero(np.r_[True, numbers[1:]!=numbers[:-1]])
+        stops=np.r_[starts[1:], len(numbers)]
+        for start, stop in zip(starts, stops):
+            index[numbers[start]]=date_runs(df_us['date'].iloc[start:stop], start)
+    return index
+
+# The time series behind df_location and df_range: one locations x dates
+# matrix per metric and rate, so a request only turns a matrix into lists
+# instead of grouping the frame. `total` holds the area's own row (the world,
+# the country or the state) per column, or is None.
+Timeline = namedtuple('Timeline', ['labels', 'dates', 'values', 'total'])
+
+def timeline(frame, key, total=None):
+    loc_codes, labels=pd.factorize(frame[key], sort=True)
+    date_codes, dates=pd.factorize(frame['date'], sort=True)
+    matrices=dict()
+    for col in values(frame):
+        matrix=np.full((len(labels), len(dates)), np.nan)
+        matrix[loc_codes, date_codes]=frame[col].to_numpy()
+        matrices[col]=matrix
+    if total is not None:
+        index=pd.DatetimeIndex(dates).get_indexer(total['date'])
+        rows=dict()
+        for col in matrices:
+            row=np.full(len(dates), np.nan)
+            row[index[index>=0]]=total[col].to_numpy()[index>=0]
+            rows[col]=row
+        total=rows
+    return Timeline(list(labels), [date.strftime('%Y-%m-%d') for date in dates], matrices, total)
+
+# The level above every area, summed once per snapshot: the world from the
+# countries, the USA from the states (which are the county sums) and each
+# state from df_states. One row per area and date, with rates and derived
+# series like any location.
+def totals(df, df_states):
+    parts=[]
+    for area, frame in [('World', df), ('USA', df_states)]:
+        columns=[metric for metric in METRICS if metric in frame]+['Population']
+        parts.append(frame.groupby('date')[columns].sum().reset_index().assign(area=area))
+    columns=[metric for metric in METRICS if metric in df_states]+['Population']
+    states=df_states[['number', 'date']+columns].rename(columns={'number':'area'})
+    parts.append(states.astype({'area':str}))
+    frame=pd.concat(parts, ignore_index=True)
+    for metric in METRICS:
+        if metric in frame:
+            with np.errstate(divide='ignore', invalid='ignore'):
+                frame[f'{metric}_rate']=np.trunc(frame[metric]/frame['Population']*1000000000)
+    return derive(frame, 'area')
+
+# {area: rows of totals()}
+def area_totals(df, df_states):
+    return dict(tuple(totals(df, df_states).groupby('area', sort=False)))
+
+# {area: Timeline}, the counties of each state on their own.
+def timelines(df, df_states, df_us, dates, total=None):
+    total=total or area_totals(df, df_states)
+    result={'World':timeline(df, 'iso3', total.get('World')), 'USA':timeline(df_states, 'abbreviation', total.get('USA'))}
+    for area, runs in dates.items():
+        if area not in result and runs:
+            start, stop=min(runs.values())[0], max(runs.values())[1]
+            result[area]=timeline(df_us.iloc[start:stop], 'FIPS', total.get(area))
+    return result
+
+# The (date, metric) pairs where the USA total summed from the counties is
+# more than `tolerance` (relative) away from the country-level USA row of the
+# global files.
+TOLERANCE = 0.01
+
+def consistency(timelines, tolerance=TOLERANCE):
+    world, usa=timelines.get('World'), timelines.get('USA')
+    report={'checked':0, 'tolerance':tolerance, 'mismatches':[]}
+    if world is None or usa is None or usa.total is None or 'USA' not in world.labels:
+        return report
+    row=world.labels.index('USA')
+    columns={date:i for i, date in enumerate(world.dates)}
+    common=[(date, columns[date], j) for j, date in enumerate(usa.dates) if date in columns]
+    for metric in METRICS:
+        if metric not in usa.total or metric not in world.values:
+            continue
+        for date, i, j in common:
+            country, counties=world.values[metric][row, i], usa.total[metric][j]
+            if np.isnan(country) or np.isnan(counties):
+                continue
+            report['checked']+=1
+            if abs(counties-country)>tolerance*max(abs(country), 1):
+                report['mismatches'].append({'date':date, 'metric':metric, 'counties':int(counties), 'country':int(country)})
+    return report
+
+def rows(values):
+    integral=np.array_equal(values, np.round(values), equal_nan=True)
+    if np.isnan(values).any():
+        return [[None if np.isnan(x) else int(x) if integral else round(float(x), 2) for x in row] for row in values]
+    return values.astype('int64').tolist() if integral else np.round(values, 2).tolist()
+
+# The series of every location plus the area's total, if it has one.
+def payload(timeline, metric):
+    result={'dates':timeline.dates, 'series':dict(zip(timeline.labels, rows(timeline.values[metric])))}
+    if timeline.total is not None:
+        result['total']=rows(timeline.total[metric][None])[0]
+    return result
+
+# Static attributes of an area's locations, sent once per area by the binary
+# wire format, and for every row of the area its index into them.
+Locations = namedtuple('Locations', ['attributes', 'codes', 'offset'])
+
+def locations(frame, key, columns, offset=0):
+    codes, labels=pd.factorize(frame[key], sort=True)
+    _, first=np.unique(codes, return_index=True)
+    return Locations({col:frame[col].iloc[first].tolist() for col in columns}, codes.astype('int32'), offset)
+
+def area_locations(df, df_states, df_us, dates):
+    result={'World':locations(df, 'iso3', ['iso3', 'Country/Region']),
+            'USA':locations(df_states, 'abbreviation', ['abbreviation', 'Province_State', 'number'])}
+    for area, runs in dates.items():
+        if area not in result and runs:
+            start, stop=min(runs.values())[0], max(runs.values())[1]
+            result[area]=locations(df_us.iloc[start:stop], 'FIPS', ['FIPS', 'Admin2', 'Lat', 'Long_'], start)
+    return result
+
+# Numeric columns as plotly typed-array specs ({'dtype', 'bdata'}).
+def encode(values):
+    dtype='i4' if values.dtype.kind in 'iu' or np.array_equal(values, np.round(values)) else 'f8'
+    return {'dtype':dtype, 'bdata':base64.b64encode(values.astype(dtype).tobytes()).decode('ascii')}
+
+def decode(spec):
+    return np.frombuffer(base64.b64decode(spec['bdata']), dtype=spec['dtype'])
+
+# `names` are the value columns to send, all of them by default.
+def binary_rows(frame, start, stop, location, names=None):
+    rows=frame.iloc[start:stop]
+    payload={'loc':encode(location.codes[start-location.offset:stop-location.offset])}
+    for col in names or values(frame):
+        payload[col]=encode(rows[col].to_numpy())
+    return payload
+
+# Every date of one series of an area as dates x locations int32 matrices
+# (averages and doubling times rounded), with MISSING where a location has no
+# row or value on that date. The columns follow the area's Locations
+# attributes, both being sorted by the same key.
+MISSING = np.iinfo('int32').min
+
+def dense(timeline, metric):
+    payload={'columns':columns(metric)}
+    for col in payload['columns']:
+        values=np.round(timeline.values[col].T)
+        values=np.clip(values, MISSING+1, np.iinfo('int32').max)
+        payload[col]=encode(np.where(np.isnan(values), MISSING, values).astype('int32'))
+    payload['shape']=list(values.shape)
+    return payload
+
+# Back to the to_dict('list') shape update_map works with.
+def expand(payload, attributes):
+    codes=decode(payload['loc'])
+    result={col:[values[i] for i in codes] for col, values in attributes.items()}
+    for key, spec in payload.items():
+        if key!='loc' and isinstance(spec, dict):
+            result[key]=decode(spec).tolist()
+    return result
+
+# Snapshots written before the derived series get them computed here. df_us
+# may be None, leaving the state areas out.
+def prepare(df, df_states, df_us, total=None):
+    frames=[None if frame is None else sort(frame, ORDER[name]) for name, frame in zip(['df', 'df_states', 'df_us'], [df, df_states, df_us])]
+    df, df_states, df_us=[frame if frame is None or f'confirmed_{DERIVED[0]}' in frame else derive(frame, ORDER[name][-1])
+                          for name, frame in zip(['df', 'df_states', 'df_us'], frames)]
+    dates=date_index(df, df_states, df_us)
+    return (df, df_states, df_us, dates, timelines(df, df_states, df_us, dates, total),
+            area_locations(df, df_states, df_us, dates))
+
+# Everything the callbacks read for one area: the schema.compact fact and
+# dimension tables, the {date: (start, stop)} rows of the facts, its Timeline
+# and Locations.
+Area = namedtuple('Area', ['facts', 'dimension', 'dates', 'timeline', 'locations'])
+
+def area(frame, name, dates, timeline, locations):
+    facts, dimension=schema.compact(frame, **schema.SCHEMA[name])
+    return Area(facts, dimension, dates, timeline, locations)
+
+# The World and USA areas with the totals of every area, built once per
+# snapshot by snapshot.write so the app can memory-map them.
+def served(df, df_states):
+    total=area_totals(df, df_states)
+    df, df_states, _, dates, timelines, locations=prepare(df, df_states, None, total)
+    areas={name:area(frame, table, dates[name], timelines[name], locations[name])
+           for name, table, frame in [('World', 'df', df), ('USA', 'df_states', df_states)]}
+    return areas, total
+
+# The Area of one state's counties, from that state's rows of df_us alone.
+def county_area(frame, total=None):
+    frame=sort(frame, ORDER['df_us'])
+    if f'confirmed_{DERIVED[0]}' not in frame:
+        frame=derive(frame, ORDER['df_us'][-1])
+    return area(frame, 'df_us', date_runs(frame['date']), timeline(frame, 'FIPS', total),
+                locations(frame, 'FIPS', ['FIPS', 'Admin2', 'Lat', 'Long_']))
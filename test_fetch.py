@@ -0,0 +1,61 @@
+import os
+import json
+import pytest
+import benchmark
+import fetch
+
+@pytest.fixture
+def upstream(tmp_path):
+    directory=tmp_path/'upstream'
+    directory.mkdir()
+    (directory/'a.csv').write_text('x,y\n1,2\n')
+    (directory/'b.csv').write_text('x,y\n3,4\n')
+    server, base=benchmark.stand_in(str(directory), 0)
+    yield directory, server, base
+    server.shutdown()
+    server.server_close()
+
+def statuses(files):
+    return {os.path.basename(url):fetched.status for url, fetched in files.items()}
+
+def test_conditional_requests(upstream, tmp_path):
+    directory, _, base=upstream
+    mirror=str(tmp_path/'mirror')
+    urls=[base+'a.csv', base+'b.csv']
+    files=fetch.fetch(urls, mirror)
+    assert statuses(files)=={'a.csv':'downloaded', 'b.csv':'downloaded'}
+    path=files[urls[0]].path
+    with open(path) as f:
+        assert f.read()=='x,y\n1,2\n'
+    meta=fetch.read_meta(path)
+    assert set(meta)=={'ETag', 'Last-Modified'}
+
+    # answered 304 on the ETag, or on Last-Modified without one
+    assert statuses(fetch.fetch(urls, mirror))=={'a.csv':'not modified', 'b.csv':'not modified'}
+    with open(path+'.meta', 'w') as f:
+        json.dump({'Last-Modified':meta['Last-Modified']}, f)
+    assert fetch.fetch(urls[:1], mirror)[urls[0]].status=='not modified'
+
+    # a changed file is downloaded again and its .meta replaced
+    (directory/'a.csv').write_text('x,y\n1,2\n5,6\n')
+    stat=os.stat(directory/'a.csv')
+    os.utime(directory/'a.csv', (stat.st_atime+10, stat.st_mtime+10))
+    assert statuses(fetch.fetch(urls, mirror))=={'a.csv':'downloaded', 'b.csv':'not modified'}
+    with open(path) as f:
+        assert f.read()=='x,y\n1,2\n5,6\n'
+    changed=fetch.read_meta(path)
+    assert changed['ETag']!=meta['ETag'] and changed['Last-Modified']!=meta['Last-Modified']
+
+def test_stale_copy_when_server_is_down(upstream, tmp_path):
+    _, server, base=upstream
+    mirror=str(tmp_path/'mirror')
+    fetched=fetch.fetch([base+'a.csv'], mirror)[base+'a.csv']
+    server.shutdown()
+    server.server_close()
+    stale=fetch.fetch([base+'a.csv'], mirror)[base+'a.csv']
+    assert (stale.status, stale.path, stale.bytes)==('stale', fetched.path, 0)
+    with open(stale.path) as f:
+        assert f.read()=='x,y\n1,2\n'
+    # without a copy there is nothing to fall back to
+    with pytest.raises(OSError):
+        fetch.fetch([base+'b.csv'], mirror)
@@ -0,0 +1,64 @@
+import os
+import sys
+import json
+import socket
+import threading
+import subprocess
+import pytest
+import memo
+
+# Each worker is a separate interpreter calling a memoized function through
+# memo.memoize with the given data version, the way the gunicorn workers call
+# the callbacks, and reports which calls it computed.
+WORKER = '''
+import sys, json, flask, flask_caching, memo
+server=flask.Flask('worker')
+cache=flask_caching.Cache(server, config=memo.cache_config(sys.argv[1]))
+computed=[]
+@memo.memoize(cache, lambda: sys.argv[2])
+def square(x):
+    computed.append(x)
+    return x*x
+with server.app_context():
+    results=[square(x) for x in [1, 2, 2]]
+print(json.dumps({'results':results, 'computed':computed, 'stats':memo.stats.report()['square']}))
+'''
+
+def worker(cache_type, version, env):
+    out=subprocess.run([sys.executable, '-c', WORKER, cache_type, version], cwd=memo.ROOT, env=dict(os.environ, **env),
+                       capture_output=True, text=True, check=True)
+    return json.loads(out.stdout.splitlines()[-1])
+
+def check_shared(cache_type, env):
+    first=worker(cache_type, 'v1', env)
+    assert first['results']==[1, 4, 4]
+    assert first['computed']==[1, 2]
+    assert first['stats']=={'hits':1, 'misses':2}
+    # another worker on the same version reads the first one's entries
+    second=worker(cache_type, 'v1', env)
+    assert second['results']==[1, 4, 4]
+    assert second['computed']==[]
+    assert second['stats']=={'hits':3, 'misses':0}
+    # a new data version misses everything the old one stored
+    third=worker(cache_type, 'v2', env)
+    assert third['results']==[1, 4, 4]
+    assert third['computed']==[1, 2]
+    assert third['stats']=={'hits':1, 'misses':2}
+
+def test_filesystem_shared_between_processes(tmp_path):
+    check_shared('filesystem', {'CACHE_DIR':str(tmp_path)})
+
+def test_redis_shared_between_processes():
+    fakeredis=pytest.importorskip('fakeredis')
+    if not hasattr(fakeredis, 'TcpFakeServer'):
+        pytest.skip('fakeredis has no TcpFakeServer')
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        port=s.getsockname()[1]
+    server=fakeredis.TcpFakeServer(('127.0.0.1', port))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    try:
+        check_shared('redis', {'REDIS_URL':f'redis://127.0.0.1:{port}'})
+    finally:
+        server.shutdown()
+        server.server_close()
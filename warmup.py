@@ -0,0 +1,92 @@
+import os
+import sys
+import time
+import pickle
+import bisect
+import itertools
+import multiprocessing
+import pipeline
+import store
+
+WARMUP = os.environ.get('WARMUP', '0')=='1'
+# bytes of pickled results the warm-up may put in the cache
+WARMUP_BUDGET = int(os.environ.get('WARMUP_BUDGET_MB', '256'))*2**20
+WARMUP_WORKERS = int(os.environ.get('WARMUP_WORKERS', '0')) or os.cpu_count()
+# results the warm-up may put in the cache; app.py raises the simple and
+# filesystem backends' CACHE_THRESHOLD by as much, so they are not evicted
+WARMUP_ENTRIES = int(os.environ.get('WARMUP_ENTRIES', '20000'))
+
+AREAS = ['World', 'USA']+[number for number, _ in pipeline.abbreviations.values()]
+
+# (callback name, args) in the order they are warmed: everything a first
+# visit to an area needs before the dates a visitor scrubs to.
+def tasks(ticks, callbacks, areas=AREAS):
+    for area in areas:
+        if 'df_geojson' in callbacks:
+            yield 'df_geojson', (area, 1)
+        if 'df_locations' in callbacks:
+            yield 'df_locations', (area,)
+        for metric in store.METRICS:
+            for series in store.series(metric):
+                for name in ['df_location', 'df_range']:
+                    if name in callbacks:
+                        yield name, (series, area)
+        if 'df_date' in callbacks:
+            for tick in ticks:
+                yield 'df_date', (tick, area, store.METRICS[0])
+
+# Set before the pool forks, so the workers inherit the frames instead of
+# having them pickled over.
+_server = None
+_callbacks = None
+
+# A callback that raises (a metric an area does not have) is left uncached,
+# as it would be when called lazily.
+def compute(task):
+    name, args=task
+    try:
+        with _server.app_context():
+            value=_callbacks[name].uncached(*args)
+    except Exception:
+        return name, args, 0, None
+    data=pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+    return name, args, len(data), data
+
+# Computes the memoized callbacks in a forked process pool and stores the
+# results the same way memo.memoize would have. Stops once the results would
+# go over the budget or over `entries`; the report says how many areas were
+# warmed completely before that.
+def run(server, cache, callbacks, ticks, areas=AREAS, budget=WARMUP_BUDGET, entries=WARMUP_ENTRIES,
+        workers=WARMUP_WORKERS, log=sys.stderr):
+    global _server, _callbacks
+    _server, _callbacks=server, callbacks
+    todo=list(tasks(ticks, callbacks, areas))
+    ends=list(itertools.accumulate(sum(1 for _ in tasks(ticks, callbacks, [area])) for area in areas))
+    report={'tasks':len(todo), 'cached':0, 'failed':0, 'bytes':0, 'over_budget':False, 'workers':workers,
+            'areas':0, 'of_areas':len(areas)}
+    done=0
+    start=time.time()
+    step=max(len(todo)//10, 1)
+    with multiprocessing.get_context('fork').Pool(workers) as pool, server.app_context():
+        for i, (name, args, size, data) in enumerate(pool.imap(compute, todo, chunksize=16)):
+            if data is None:
+                report['failed']+=1
+                done=i+1
+                continue
+            if report['bytes']+size>budget or report['cached']>=entries:
+                report['over_budget']=True
+                break
+            callback=callbacks[name]
+            cache.set(callback.make_cache_key(callback.uncached, *args), pickle.loads(data))
+            report['cached']+=1
+            report['bytes']+=size
+            done=i+1
+            if (i+1)%step==0:
+                print(f'warmup {i+1}/{len(todo)} {report["bytes"]/2**20:.1f} MB {time.time()-start:.1f} s', file=log)
+        pool.terminate()
+    report['seconds']=time.time()-start
+    report['areas']=bisect.bisect_right(ends, done)
+    print(f'warmup done: {report["areas"]}/{len(areas)} areas, {report["cached"]}/{len(todo)} results '
+          f'({report["failed"]} failed), {report["bytes"]/2**20:.1f} MB in {report["seconds"]:.1f} s'
+          f'{", stopped at the limit" if report["over_budget"] else ""}', file=log)
+    return report